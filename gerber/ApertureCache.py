@@ -0,0 +1,84 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import threading
+import collections
+from .ApertureRenderer import ApertureRenderer
+
+class ApertureCache():
+	"""LRU cache of rendered aperture bitmaps. Rendered apertures are only
+	ever used as blit source and therefore can be shared by all layers and
+	renders that use the same aperture at the same resolution and color. Safe
+	to share between threads."""
+
+	def __init__(self, max_entries = 256):
+		self._max_entries = max_entries
+		self._cache = collections.OrderedDict()
+		self._lock = threading.Lock()
+		self._hits = 0
+		self._misses = 0
+
+	@property
+	def hits(self):
+		return self._hits
+
+	@property
+	def misses(self):
+		return self._misses
+
+	@staticmethod
+	def _definition_key(aperture_definition):
+		if aperture_definition.is_macro:
+			return ("macro", aperture_definition.name, aperture_definition.macro.words, aperture_definition.params, aperture_definition.scale)
+		else:
+			return (aperture_definition.template, tuple(aperture_definition.params))
+
+	def _lookup(self, key, create_aperture):
+		with self._lock:
+			aperture = self._cache.get(key)
+			if aperture is not None:
+				self._hits += 1
+				self._cache.move_to_end(key)
+				return aperture
+
+			self._misses += 1
+			aperture = create_aperture()
+			self._cache[key] = aperture
+			if len(self._cache) > self._max_entries:
+				self._cache.popitem(last = False)
+			return aperture
+
+	def get(self, aperture_definition, dpi, color):
+		key = (self._definition_key(aperture_definition), dpi, tuple(color))
+		return self._lookup(key, lambda: ApertureRenderer.from_definition(aperture_definition, dpi = dpi, color = color))
+
+	def get_raw(self, aperture_definition_template, aperture_definition_params, dpi, color):
+		key = ((aperture_definition_template, tuple(aperture_definition_params)), dpi, tuple(color))
+		return self._lookup(key, lambda: ApertureRenderer.from_raw_definition(aperture_definition_template, aperture_definition_params, dpi = dpi, color = color))
+
+	def clear(self):
+		with self._lock:
+			self._cache.clear()
+
+	def __len__(self):
+		return len(self._cache)
+
+	def __str__(self):
+		return "ApertureCache<%d of %d entries used, %d hits, %d misses>" % (len(self), self._max_entries, self.hits, self.misses)
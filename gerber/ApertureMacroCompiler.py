@@ -0,0 +1,116 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+import collections
+
+class ApertureMacroSyntaxError(Exception): pass
+
+class ApertureMacroCompiler():
+	"""Compiles the body of an aperture macro, i.e., the words of an %AM
+	command following the name, once into a Python function. The function
+	takes the aperture parameters ($1, $2, ...) and returns a list of
+	(primitive code, parameter values) tuples, with all variables and
+	arithmetic expressions already evaluated. Values are in the unit of the
+	Gerber file."""
+	_COMMENT_CODE = 0
+	_ASSIGNMENT_RE = re.compile(r"\$(?P<var>\d+)=(?P<expr>.+)")
+	_PRIMITIVE_RE = re.compile(r"(?P<code>\d+)(?P<params>,.*)?")
+	_TOKEN_RE = re.compile(r"(?P<number>\d+\.?\d*|\.\d+)|\$(?P<var>\d+)|(?P<op>[-+xX/()])")
+	_OPERATORS = {
+		"+":	"+",
+		"-":	"-",
+		"x":	"*",
+		"X":	"*",
+		"/":	"/",
+		"(":	"(",
+		")":	")",
+	}
+
+	def __init__(self, name, words):
+		self._name = name
+		self._words = tuple(words)
+
+	@classmethod
+	def _expression(cls, text):
+		"""Translates an arithmetic expression into a Python expression.
+		Variables become lookups in the dictionary 'v', the Gerber
+		multiplication operator 'x' becomes '*'."""
+		text = text.replace(" ", "")
+		if text == "":
+			raise ApertureMacroSyntaxError("Empty expression.")
+		tokens = [ ]
+		offset = 0
+		while offset < len(text):
+			match = cls._TOKEN_RE.match(text, offset)
+			if match is None:
+				raise ApertureMacroSyntaxError("Invalid expression '%s', cannot parse at '%s'." % (text, text[offset:]))
+			if match["number"] is not None:
+				tokens.append(repr(float(match["number"])))
+			elif match["var"] is not None:
+				tokens.append("v[%d]" % (int(match["var"])))
+			else:
+				tokens.append(cls._OPERATORS[match["op"]])
+			offset = match.end()
+		expression = " ".join(tokens)
+		try:
+			compile(expression, "<expression>", "eval")
+		except SyntaxError:
+			raise ApertureMacroSyntaxError("Invalid expression '%s'." % (text))
+		return "(%s)" % (expression)
+
+	def source(self):
+		"""Returns the Python source code of the macro function."""
+		lines = [
+			"def evaluate(v):",
+			"\tprimitives = [ ]",
+		]
+		for word in self._words:
+			word = word.strip()
+			match = self._ASSIGNMENT_RE.fullmatch(word)
+			if match is not None:
+				lines.append("\tv[%d] = %s" % (int(match["var"]), self._expression(match["expr"])))
+				continue
+
+			match = self._PRIMITIVE_RE.match(word)
+			if match is None:
+				raise ApertureMacroSyntaxError("Aperture macro %s: cannot parse '%s'." % (self._name, word))
+			code = int(match["code"])
+			if code == self._COMMENT_CODE:
+				continue
+			if match.end() != len(word):
+				raise ApertureMacroSyntaxError("Aperture macro %s: cannot parse '%s'." % (self._name, word))
+			params = [ ] if (match["params"] is None) else match["params"][1:].split(",")
+			lines.append("\tprimitives.append((%d, (%s)))" % (code, "".join(self._expression(param) + ", " for param in params)))
+		lines.append("\treturn primitives")
+		return "\n".join(lines) + "\n"
+
+	def compile(self):
+		"""Returns a function that maps a tuple of aperture parameters to the
+		list of evaluated primitives. Undefined variables evaluate to zero."""
+		namespace = { }
+		exec(compile(self.source(), "<aperture macro %s>" % (self._name), "exec"), namespace)
+		evaluate = namespace["evaluate"]
+		def evaluate_params(params):
+			variables = collections.defaultdict(float)
+			for (index, value) in enumerate(params, 1):
+				variables[index] = value
+			return evaluate(variables)
+		return evaluate_params
@@ -0,0 +1,254 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import math
+import enum
+import cairo
+from .Vector2d import Vector2d
+from .Extents import Extents
+
+class ApertureMacroPrimitiveCode(enum.IntEnum):
+	Comment = 0
+	Circle = 1
+	VectorLineLegacy = 2
+	VectorLine = 20
+	CenterLine = 21
+	LowerLeftLine = 22
+	Outline = 4
+	Polygon = 5
+	Moire = 6
+	Thermal = 7
+
+class ApertureMacroShape():
+	"""Geometry of one aperture macro instance, i.e., a macro evaluated for
+	one parameter tuple, relative to the flash point and in inches. Every
+	primitive is a list of closed contours; contours run counter-clockwise
+	and holes (of moire rings) clockwise so that all exposed primitives can
+	be filled together as one path using the nonzero winding rule. Contours
+	are lists of ("move", x, y), ("line", x, y) and ("arc", cx, cy, r,
+	angle1, angle2, negative) commands."""
+
+	def __init__(self, primitives, scale = 1):
+		self._scale = scale
+		self._primitives = [ ]
+		self._extents = Extents()
+		self._cairo_path = None
+		for (code, values) in primitives:
+			try:
+				code = ApertureMacroPrimitiveCode(code)
+			except ValueError:
+				raise NotImplementedError("Aperture macro primitive %d is unsupported." % (code))
+			getattr(self, "_primitive_" + code.name)(values)
+
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		state["_cairo_path"] = None
+		return state
+
+	@staticmethod
+	def _rotate(x, y, angle):
+		(sin, cos) = (math.sin(angle), math.cos(angle))
+		return ((x * cos) - (y * sin), (x * sin) + (y * cos))
+
+	@staticmethod
+	def _rotation(values, index):
+		return math.radians(values[index]) if (len(values) > index) else 0
+
+	def _add_primitive(self, exposure, contours):
+		"""Adds a primitive given in file units, scaling it to inches. Only
+		exposed primitives contribute to the extents."""
+		scaled_contours = [ ]
+		for contour in contours:
+			scaled_contour = [ ]
+			for command in contour:
+				if command[0] == "arc":
+					(cmd, cx, cy, radius, angle1, angle2, negative) = command
+					scaled_contour.append((cmd, cx * self._scale, cy * self._scale, radius * self._scale, angle1, angle2, negative))
+				else:
+					(cmd, x, y) = command
+					scaled_contour.append((cmd, x * self._scale, y * self._scale))
+			scaled_contours.append(scaled_contour)
+		if exposure:
+			for contour in scaled_contours:
+				self._add_extents(contour)
+		self._primitives.append((exposure, scaled_contours))
+
+	def _add_extents(self, contour):
+		for command in contour:
+			if command[0] != "arc":
+				self._extents.add_point(Vector2d(command[1], command[2]))
+				continue
+			(cmd, cx, cy, radius, angle1, angle2, negative) = command
+			if negative:
+				# Holes lie within their outer contour
+				continue
+			center = Vector2d(cx, cy)
+			if angle2 - angle1 >= 2 * math.pi:
+				self._extents.add_circle(center, radius)
+			else:
+				self._extents.add_arc(center + Vector2d.unit_angle(angle1) * radius, center + Vector2d.unit_angle(angle2) * radius, center, False)
+
+	def _polygon(self, points, rotation):
+		"""Returns a counter-clockwise contour through the points, rotated
+		around the macro origin."""
+		points = [ self._rotate(x, y, rotation) for (x, y) in points ]
+		area = sum((x0 * y1) - (x1 * y0) for ((x0, y0), (x1, y1)) in zip(points, points[1:] + points[:1]))
+		if area < 0:
+			points.reverse()
+		return [ ("move", points[0][0], points[0][1]) ] + [ ("line", x, y) for (x, y) in points[1:] ]
+
+	def _circle(self, cx, cy, radius, rotation, negative = False):
+		(cx, cy) = self._rotate(cx, cy, rotation)
+		if negative:
+			return [ ("arc", cx, cy, radius, 2 * math.pi, 0, True) ]
+		return [ ("arc", cx, cy, radius, 0, 2 * math.pi, False) ]
+
+	def _rectangle(self, cx, cy, width, height, rotation):
+		(w, h) = (width / 2, height / 2)
+		return self._polygon([ (cx - w, cy - h), (cx + w, cy - h), (cx + w, cy + h), (cx - w, cy + h) ], rotation)
+
+	def _primitive_Circle(self, values):
+		(exposure, diameter, cx, cy) = values[:4]
+		self._add_primitive(exposure != 0, [ self._circle(cx, cy, diameter / 2, self._rotation(values, 4)) ])
+
+	def _primitive_VectorLine(self, values):
+		(exposure, width, sx, sy, ex, ey) = values[:6]
+		length = math.hypot(ex - sx, ey - sy)
+		if length == 0:
+			return
+		(nx, ny) = (-(ey - sy) / length * width / 2, (ex - sx) / length * width / 2)
+		self._add_primitive(exposure != 0, [ self._polygon([ (sx + nx, sy + ny), (sx - nx, sy - ny), (ex - nx, ey - ny), (ex + nx, ey + ny) ], self._rotation(values, 6)) ])
+
+	_primitive_VectorLineLegacy = _primitive_VectorLine
+
+	def _primitive_CenterLine(self, values):
+		(exposure, width, height, cx, cy) = values[:5]
+		self._add_primitive(exposure != 0, [ self._rectangle(cx, cy, width, height, self._rotation(values, 5)) ])
+
+	def _primitive_LowerLeftLine(self, values):
+		(exposure, width, height, x, y) = values[:5]
+		self._add_primitive(exposure != 0, [ self._rectangle(x + (width / 2), y + (height / 2), width, height, self._rotation(values, 5)) ])
+
+	def _primitive_Outline(self, values):
+		(exposure, vertex_count) = values[:2]
+		coordinates = values[2 : 2 + (2 * (int(vertex_count) + 1))]
+		points = list(zip(coordinates[0::2], coordinates[1::2]))
+		if (len(points) > 1) and (points[0] == points[-1]):
+			# The closing point repeats the first one
+			points = points[:-1]
+		if len(points) < 3:
+			return
+		self._add_primitive(exposure != 0, [ self._polygon(points, self._rotation(values, 2 + len(coordinates))) ])
+
+	def _primitive_Polygon(self, values):
+		(exposure, vertex_count, cx, cy, diameter) = values[:5]
+		vertex_count = int(vertex_count)
+		points = [ (cx + (diameter / 2 * math.cos(2 * math.pi * i / vertex_count)), cy + (diameter / 2 * math.sin(2 * math.pi * i / vertex_count))) for i in range(vertex_count) ]
+		self._add_primitive(exposure != 0, [ self._polygon(points, self._rotation(values, 5)) ])
+
+	def _primitive_Moire(self, values):
+		(cx, cy, outer_diameter, thickness, gap, max_rings, crosshair_thickness, crosshair_length) = values[:8]
+		rotation = self._rotation(values, 8)
+		contours = [ ]
+		radius = outer_diameter / 2
+		for ring in range(int(max_rings)):
+			if radius <= 0:
+				break
+			contours.append(self._circle(cx, cy, radius, rotation))
+			if radius - thickness > 0:
+				contours.append(self._circle(cx, cy, radius - thickness, rotation, negative = True))
+			radius -= thickness + gap
+		if (crosshair_thickness > 0) and (crosshair_length > 0):
+			contours.append(self._rectangle(cx, cy, crosshair_length, crosshair_thickness, rotation))
+			contours.append(self._rectangle(cx, cy, crosshair_thickness, crosshair_length, rotation))
+		self._add_primitive(True, contours)
+
+	def _primitive_Thermal(self, values):
+		(cx, cy, outer_diameter, inner_diameter, gap) = values[:5]
+		rotation = self._rotation(values, 5)
+		(outer_radius, inner_radius, half_gap) = (outer_diameter / 2, inner_diameter / 2, gap / 2)
+		if half_gap >= outer_radius / math.sqrt(2):
+			# Gaps cover everything
+			return
+		(center_x, center_y) = self._rotate(cx, cy, rotation)
+		outer_angle = math.asin(half_gap / outer_radius)
+		contours = [ ]
+		for quadrant in range(4):
+			angle = (quadrant * math.pi / 2) + rotation
+			contour = [ ("arc", center_x, center_y, outer_radius, angle + outer_angle, angle + (math.pi / 2) - outer_angle, False) ]
+			if half_gap < inner_radius / math.sqrt(2):
+				inner_angle = math.asin(half_gap / inner_radius)
+				contour.append(("arc", center_x, center_y, inner_radius, angle + (math.pi / 2) - inner_angle, angle + inner_angle, True))
+			else:
+				(x, y) = self._rotate(half_gap, half_gap, angle)
+				contour.append(("line", center_x + x, center_y + y))
+			contours.append(contour)
+		self._add_primitive(True, contours)
+
+	@property
+	def primitives(self):
+		"""List of (exposure, contours) tuples in drawing order."""
+		return self._primitives
+
+	@property
+	def has_clear(self):
+		return any(not exposure for (exposure, contours) in self._primitives)
+
+	@property
+	def bounding_box(self):
+		"""Exact bounds of the exposed area relative to the flash point, or
+		None if nothing is exposed."""
+		return self._extents.bounding_box
+
+	@property
+	def extents(self):
+		"""Half width and half height of the smallest bounding box centered on
+		the flash point, like ApertureDefinition.extents."""
+		if self._extents.empty:
+			return Vector2d(0, 0)
+		(min_pt, max_pt) = (self._extents.min_pt, self._extents.max_pt)
+		return Vector2d(max(-min_pt.x, max_pt.x), max(-min_pt.y, max_pt.y))
+
+	@staticmethod
+	def append_contours(cctx, contours):
+		"""Appends contours to the current path of a Cairo context."""
+		for contour in contours:
+			cctx.new_sub_path()
+			for command in contour:
+				if command[0] == "line":
+					cctx.line_to(command[1], command[2])
+				elif command[0] == "move":
+					cctx.move_to(command[1], command[2])
+				elif command[6]:
+					cctx.arc_negative(*command[1:6])
+				else:
+					cctx.arc(*command[1:6])
+			cctx.close_path()
+
+	def cairo_path(self):
+		"""Returns all exposed primitives as one Cairo path in inches. It is
+		built once and then only appended at every flash position."""
+		if self._cairo_path is None:
+			cctx = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A8, 1, 1))
+			for (exposure, contours) in self._primitives:
+				if exposure:
+					self.append_contours(cctx, contours)
+			self._cairo_path = cctx.copy_path()
+		return self._cairo_path
@@ -19,6 +19,7 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import math
+import cairo
 from .CairoContext import CairoContext
 from .Vector2d import Vector2d
 
@@ -132,9 +133,26 @@ class ApertureRenderer():
 		return aperture
 
 	@classmethod
-	def from_macro_definition(cls, aperture_macro, dpi, color):
-		print("TODO: NOT IMPLEMENTED")
-		aperture = cls.generate_circular(5, color = color)
+	def from_macro_definition(cls, aperture_macro_instance, dpi, color):
+		"""Renders the macro's primitives in order; primitives with exposure
+		off clear what previous primitives of the aperture have drawn."""
+		shape = aperture_macro_instance.shape
+		padding = 2
+		half_extents = shape.extents * dpi
+		dimensions = Vector2d((2 * math.ceil(half_extents.x)) + (2 * padding), (2 * math.ceil(half_extents.y)) + (2 * padding))
+		aperture = CairoContext(dimensions = dimensions, dpi = None)
+
+		if color in cls._COLORS:
+			(r, g, b) = cls._COLORS.get(color)
+		else:
+			(r, g, b) = color
+		aperture.cctx.set_source_rgb(r, g, b)
+		aperture.cctx.translate(dimensions.x / 2, dimensions.y / 2)
+		aperture.cctx.scale(dpi, dpi)
+		for (exposure, contours) in shape.primitives:
+			aperture.cctx.set_operator(cairo.OPERATOR_OVER if exposure else cairo.OPERATOR_CLEAR)
+			shape.append_contours(aperture.cctx, contours)
+			aperture.cctx.fill()
 		aperture.dpi = dpi
 		return aperture
 
@@ -145,23 +163,105 @@ class ApertureRenderer():
 		else:
 			return cls.from_macro_definition(aperture_definition, dpi, color)
 
+	@staticmethod
+	def _convex_hull(points):
+		"""Monotone chain convex hull, returns the hull counter-clockwise."""
+		points = sorted(set((point.x, point.y) for point in points))
+		if len(points) <= 2:
+			return [ Vector2d(x, y) for (x, y) in points ]
+
+		def cross(o, a, b):
+			return ((a[0] - o[0]) * (b[1] - o[1])) - ((a[1] - o[1]) * (b[0] - o[0]))
+
+		lower = [ ]
+		for point in points:
+			while (len(lower) >= 2) and (cross(lower[-2], lower[-1], point) <= 0):
+				lower.pop()
+			lower.append(point)
+		upper = [ ]
+		for point in reversed(points):
+			while (len(upper) >= 2) and (cross(upper[-2], upper[-1], point) <= 0):
+				upper.pop()
+			upper.append(point)
+		return [ Vector2d(x, y) for (x, y) in lower[:-1] + upper[:-1] ]
+
 	@classmethod
-	def physical_extents_macro(cls, aperture_macro):
-		print("TODO: NOT IMPLEMENTED")
-		return Vector2d(0.1, 0.1)
+	def draw_line(cls, destination_ctx, aperture_definition, start_pt, end_pt, color, unit = "px"):
+		"""Draws the area that the aperture sweeps when moved from the start
+		to the end point as native Cairo geometry instead of blitting the
+		aperture bitmap at every pixel. Returns False if the aperture shape
+		cannot be drawn this way and the caller needs to blit instead."""
+		if aperture_definition.is_macro:
+			return False
+		params = aperture_definition.params
+		if aperture_definition.template == "C":
+			# Circular aperture: stroke with round caps
+			destination_ctx.stroke_line(start_pt, end_pt, width = params[0], color = color, unit = unit)
+		elif aperture_definition.template == "R":
+			# Rectangular aperture: convex hull of the rectangle at start and end
+			(half_width, half_height) = (params[0] / 2, params[1] / 2)
+			corners = [ Vector2d(half_width, half_height), Vector2d(-half_width, half_height), Vector2d(-half_width, -half_height), Vector2d(half_width, -half_height) ]
+			points = [ point + corner for point in (start_pt, end_pt) for corner in corners ]
+			destination_ctx.fill_polygon(cls._convex_hull(points), color = color, unit = unit)
+		elif aperture_definition.template == "O":
+			# Obround aperture: a line segment (the obround's straight part)
+			# widened by a circle, so sweep the segment and stroke the outline
+			# with the circle diameter
+			(width, height) = (params[0], params[1])
+			if width > height:
+				axis = Vector2d((width - height) / 2, 0)
+			else:
+				axis = Vector2d(0, (height - width) / 2)
+			points = [ start_pt - axis, start_pt + axis, end_pt + axis, end_pt - axis ]
+			destination_ctx.fill_polygon(points, color = color, outline_width = min(width, height), unit = unit)
+		else:
+			return False
+		return True
 
 	@classmethod
-	def physical_extents(cls, aperture_definition):
+	def draw_flashes(cls, destination_ctx, aperture_definition, points, color, unit = "px"):
+		"""Flashes the aperture at all points at once, as a single Cairo path
+		that is filled or stroked once. Returns False if the aperture shape
+		cannot be drawn this way and the caller needs to blit instead."""
 		if aperture_definition.is_macro:
-			return cls.physical_extents_macro(aperture_definition)
-		elif aperture_definition.template == "C":
-			# Circular aperture
-			diameter_in = aperture_definition.params[0]
-			return Vector2d(diameter_in, diameter_in)
-		elif aperture_definition.template in [ "O", "R" ]:
-			# Obround or rectangular aperture
-			width_in = aperture_definition.params[0]
-			height_in = aperture_definition.params[1]
-			return Vector2d(width_in, height_in)
+			shape = aperture_definition.shape
+			if shape.has_clear:
+				return False
+			destination_ctx.fill_instances(points, shape.cairo_path(), color = color, unit = unit)
+			return True
+		params = aperture_definition.params
+		if aperture_definition.template == "C":
+			destination_ctx.fill_circles(points, params[0] / 2, color = color, unit = unit)
+		elif aperture_definition.template == "R":
+			destination_ctx.fill_rectangles(points, params[0], params[1], color = color, unit = unit)
+		elif aperture_definition.template == "O":
+			(width, height) = (params[0], params[1])
+			if width > height:
+				axis = Vector2d((width - height) / 2, 0)
+			else:
+				axis = Vector2d(0, (height - width) / 2)
+			destination_ctx.stroke_segments(points, axis, width = min(width, height), color = color, unit = unit)
 		else:
-			raise NotImplementedError(aperture_definition)
+			return False
+		return True
+
+	@classmethod
+	def draw_arc(cls, destination_ctx, aperture_definition, start_pt, end_pt, center_pt, clockwise, color, unit = "px"):
+		"""Draws an arc as a single stroked Cairo path. Only circular apertures
+		can be expressed as a stroke, for all others False is returned and the
+		caller needs to fall back to blitting."""
+		if aperture_definition.is_macro or (aperture_definition.template != "C"):
+			return False
+		destination_ctx.stroke_arc(start_pt, end_pt, center_pt, width = aperture_definition.params[0], clockwise = clockwise, color = color, unit = unit)
+		return True
+
+	@classmethod
+	def draw_circle(cls, destination_ctx, aperture_definition, center_pt, radius, color, unit = "px"):
+		if aperture_definition.is_macro or (aperture_definition.template != "C"):
+			return False
+		destination_ctx.stroke_circle(center_pt, radius, width = aperture_definition.params[0], color = color, unit = unit)
+		return True
+
+	@classmethod
+	def physical_extents(cls, aperture_definition):
+		return aperture_definition.extents * 2
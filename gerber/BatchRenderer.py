@@ -0,0 +1,198 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import json
+import time
+import traceback
+import concurrent.futures
+from .Profiler import Profiler
+
+class BatchJob():
+	"""One board of a batch: its name, the source files (Gerber files, ZIP
+	archives or directories) and a dictionary mapping deliverable names to
+	output filenames."""
+	def __init__(self, name, sources, outfiles):
+		self._name = name
+		self._sources = sources
+		self._outfiles = outfiles
+
+	@property
+	def name(self):
+		return self._name
+
+	@property
+	def sources(self):
+		return self._sources
+
+	@property
+	def outfiles(self):
+		return self._outfiles
+
+	def __repr__(self):
+		return "BatchJob<%s: %s>" % (self.name, ", ".join(self.sources))
+
+class BatchResult():
+	def __init__(self, job, elapsed, error = None, missing = None, profile = None):
+		self._job = job
+		self._elapsed = elapsed
+		self._error = error
+		self._missing = missing or [ ]
+		self._profile = profile
+
+	@property
+	def job(self):
+		return self._job
+
+	@property
+	def elapsed(self):
+		return self._elapsed
+
+	@property
+	def error(self):
+		return self._error
+
+	@property
+	def missing(self):
+		"""Deliverables that had no content and were not written."""
+		return self._missing
+
+	@property
+	def profile(self):
+		"""Exported Profiler data of the board if profiling was requested."""
+		return self._profile
+
+	@property
+	def success(self):
+		return (self.error is None) and (len(self.missing) == 0)
+
+	def __str__(self):
+		if self.error is not None:
+			status = "FAILED: %s" % (self.error)
+		elif len(self.missing) > 0:
+			status = "FAILED: no content for %s" % (", ".join(self.missing))
+		else:
+			status = "OK"
+		return "%-30s %8.2f s  %s" % (self.job.name, self.elapsed, status)
+
+_worker_renderscript = None
+
+def _initialize_worker(renderscript):
+	global _worker_renderscript
+	# All boards rendered by this worker are cloned from this template and
+	# therefore share its aperture cache.
+	_worker_renderscript = renderscript.clone()
+
+def _render_job(template, job, options):
+	t0 = time.perf_counter()
+	profiler = Profiler(enabled = options.get("profile", False))
+	board = template.clone(profiler = profiler)
+	missing = [ ]
+	try:
+		with profiler.section(job.name):
+			for source in job.sources:
+				board.add_infile(source, recursive = options.get("recursive", False))
+			for (name, filename) in sorted(job.outfiles.items()):
+				directory = os.path.dirname(filename)
+				if directory != "":
+					os.makedirs(directory, exist_ok = True)
+				if not board.write_deliverable(name, filename, png_format = options.get("png_format", "rgba8"), compression = options.get("compression", 6), tile_size = options.get("tile_size"), common_canvas = options.get("common_canvas", False), viewport = options.get("viewport")):
+					missing.append(name)
+	except Exception as e:
+		if options.get("verbose", 0) >= 2:
+			traceback.print_exc()
+		return BatchResult(job, time.perf_counter() - t0, error = "%s: %s" % (e.__class__.__name__, str(e)), profile = profiler.export())
+	finally:
+		board.close()
+	return BatchResult(job, time.perf_counter() - t0, missing = missing, profile = profiler.export())
+
+def _render_job_in_worker(job, options):
+	return _render_job(_worker_renderscript, job, options)
+
+class BatchRenderer():
+	"""Renders many boards with one render script. Render scripts are only
+	parsed once and boards are distributed over a process pool whose workers
+	live for the whole batch, so their aperture caches stay warm between
+	boards."""
+
+	def __init__(self, renderscript, jobs = 1, options = None):
+		self._renderscript = renderscript
+		self._jobs = jobs
+		self._options = options or { }
+
+	@staticmethod
+	def _expand_outfiles(outfile_templates, board_name):
+		return { name: template.replace("{board}", board_name) for (name, template) in outfile_templates }
+
+	@classmethod
+	def jobs_from_directory(cls, directory, outfile_templates, recursive = False):
+		"""Creates one job per ZIP file in the directory, named after the
+		ZIP file without extension."""
+		jobs = [ ]
+		for (basedir, subdirs, files) in os.walk(directory):
+			subdirs.sort()
+			for filename in sorted(files):
+				(board_name, ext) = os.path.splitext(filename)
+				if ext.lower() == ".zip":
+					jobs.append(BatchJob(board_name, [ os.path.join(basedir, filename) ], cls._expand_outfiles(outfile_templates, board_name)))
+			if not recursive:
+				break
+		return jobs
+
+	@classmethod
+	def jobs_from_manifest(cls, manifest_filename, outfile_templates):
+		"""Reads a JSON manifest, a list of boards, each a dictionary with the
+		board 'name', its 'sources' and optionally the 'outfiles' dictionary
+		mapping deliverable names to filenames. Boards without 'outfiles' use
+		the given templates. Relative paths are relative to the manifest."""
+		with open(manifest_filename) as f:
+			manifest = json.load(f)
+		basedir = os.path.dirname(manifest_filename)
+		jobs = [ ]
+		for board in manifest:
+			if "outfiles" in board:
+				outfiles = board["outfiles"]
+			else:
+				outfiles = cls._expand_outfiles(outfile_templates, board["name"])
+			outfiles = { name: os.path.join(basedir, filename) for (name, filename) in outfiles.items() }
+			sources = [ os.path.join(basedir, source) for source in board["sources"] ]
+			jobs.append(BatchJob(board["name"], sources, outfiles))
+		return jobs
+
+	def run(self, jobs):
+		"""Renders all jobs and yields a BatchResult for each one as soon as
+		it is finished."""
+		if self._jobs <= 1:
+			for job in jobs:
+				yield _render_job(self._renderscript, job, self._options)
+			return
+
+		with concurrent.futures.ProcessPoolExecutor(max_workers = self._jobs, initializer = _initialize_worker, initargs = (self._renderscript, )) as executor:
+			futures = [ executor.submit(_render_job_in_worker, job, self._options) for job in jobs ]
+			for future in concurrent.futures.as_completed(futures):
+				yield future.result()
+
+	@staticmethod
+	def print_summary(results, elapsed, f = sys.stderr):
+		succeeded = [ result for result in results if result.success ]
+		print("Rendered %d boards in %.2f s: %d succeeded, %d failed." % (len(results), elapsed, len(succeeded), len(results) - len(succeeded)), file = f)
+		for result in sorted(results, key = lambda result: result.job.name):
+			print("  %s" % (result), file = f)
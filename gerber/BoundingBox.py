@@ -0,0 +1,74 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import math
+from .Vector2d import Vector2d
+
+class BoundingBox():
+	"""Axis-aligned rectangle given by its minimum and maximum corner."""
+	def __init__(self, min_pt, max_pt):
+		self._min_pt = min_pt
+		self._max_pt = max_pt
+
+	@property
+	def min_pt(self):
+		return self._min_pt
+
+	@property
+	def max_pt(self):
+		return self._max_pt
+
+	@property
+	def width(self):
+		return self.max_pt.x - self.min_pt.x
+
+	@property
+	def height(self):
+		return self.max_pt.y - self.min_pt.y
+
+	@property
+	def dimensions(self):
+		return self.max_pt - self.min_pt
+
+	def union(self, other):
+		if other is None:
+			return self
+		return BoundingBox(Vector2d(min(self.min_pt.x, other.min_pt.x), min(self.min_pt.y, other.min_pt.y)), Vector2d(max(self.max_pt.x, other.max_pt.x), max(self.max_pt.y, other.max_pt.y)))
+
+	def intersection(self, other):
+		"""Returns the overlapping area or None if the boxes do not overlap."""
+		min_pt = Vector2d(max(self.min_pt.x, other.min_pt.x), max(self.min_pt.y, other.min_pt.y))
+		max_pt = Vector2d(min(self.max_pt.x, other.max_pt.x), min(self.max_pt.y, other.max_pt.y))
+		if (min_pt.x >= max_pt.x) or (min_pt.y >= max_pt.y):
+			return None
+		return BoundingBox(min_pt, max_pt)
+
+	def pixel_aligned(self):
+		"""Returns the smallest box with integer corners enclosing this one."""
+		return BoundingBox(Vector2d(math.floor(self.min_pt.x), math.floor(self.min_pt.y)), Vector2d(math.ceil(self.max_pt.x), math.ceil(self.max_pt.y)))
+
+	def __mul__(self, scalar):
+		return BoundingBox(self.min_pt * scalar, self.max_pt * scalar)
+
+	def __eq__(self, other):
+		return (self.min_pt == other.min_pt) and (self.max_pt == other.max_pt)
+
+	def __repr__(self):
+		return "BoundingBox<%s to %s>" % (self.min_pt, self.max_pt)
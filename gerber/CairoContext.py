@@ -18,16 +18,27 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import sys
 import math
 import cairo
+try:
+	import numpy
+except ImportError:
+	numpy = None
 from .GeoInterpolation import GeoInterpolation
 from .Vector2d import Vector2d
 
 class CairoContext():
-	def __init__(self, dimensions, dpi, offset = None, surface = None):
+	# Byte offsets of the blue, green, red and alpha channel within an ARGB32
+	# pixel, which Cairo stores as a native endian 32 bit integer
+	CHANNELS = (0, 1, 2, 3) if (sys.byteorder == "little") else (3, 2, 1, 0)
+
+	def __init__(self, dimensions, dpi, offset = None, surface = None, mask = False):
+		"""With mask set, the surface only has an 8 bit alpha channel. Masks are
+		tinted in a color of choice when composed."""
 		if surface is None:
 			(width, height) = round(dimensions.x), round(dimensions.y)
-			self._surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+			self._surface = cairo.ImageSurface(cairo.FORMAT_A8 if mask else cairo.FORMAT_ARGB32, width, height)
 		else:
 			self._surface = surface
 		self._cctx = cairo.Context(self._surface)
@@ -43,12 +54,12 @@ class CairoContext():
 		self._dpi = dpi
 
 	@classmethod
-	def create_inches(cls, dimensions_inches, dpi, offset_inches = None):
+	def create_inches(cls, dimensions_inches, dpi, offset_inches = None, mask = False):
 		if offset_inches is None:
 			offset = None
 		else:
 			offset = offset_inches * dpi
-		return cls(dimensions = dimensions_inches * dpi, dpi = dpi, offset = offset)
+		return cls(dimensions = dimensions_inches * dpi, dpi = dpi, offset = offset, mask = mask)
 
 	@classmethod
 	def create_composition_canvas(cls, contexts, invert_y_axis = True):
@@ -65,15 +76,19 @@ class CairoContext():
 		offset = Vector2d(minx, miny)
 		dimensions = Vector2d(maxx, maxy) - offset
 		cctx = cls(dimensions = dimensions, offset = offset, dpi = contexts[0].dpi)
-
-		matrix = cairo.Matrix()
 		if invert_y_axis:
-			matrix.scale(1, -1)
-			matrix.translate(0, -cctx.height)
-		matrix.translate(-cctx.offset.x, -cctx.offset.y)
-		cctx.cctx.set_matrix(matrix)
+			cctx.invert_y_axis()
 		return cctx
 
+	def invert_y_axis(self):
+		"""Mirrors everything drawn or composed from now on vertically, so
+		that the surface is in image orientation (top row first)."""
+		matrix = cairo.Matrix()
+		matrix.scale(1, -1)
+		matrix.translate(0, -self.height)
+		matrix.translate(-self.offset.x, -self.offset.y)
+		self._cctx.set_matrix(matrix)
+
 	@property
 	def width(self):
 		return self.surface.get_width()
@@ -90,6 +105,10 @@ class CairoContext():
 	def offset(self):
 		return self._offset
 
+	@property
+	def is_mask(self):
+		return self._surface.get_format() == cairo.FORMAT_A8
+
 	def set_mode_draw(self):
 		self._cctx.set_operator(cairo.OPERATOR_OVER)
 
@@ -113,14 +132,23 @@ class CairoContext():
 		assert(self._dpi is None)
 		self._dpi = value
 
-	def fill(self, color):
+	def fill(self, color, area = None):
+		"""Fills the whole context or, if given, only the area (a BoundingBox
+		in pixels)."""
 		(r, g, b) = color
 		self._cctx.set_source_rgb(r, g, b)
-		self._cctx.rectangle(self.offset.x, self.offset.y, self.width, self.height)
+		if area is None:
+			self._cctx.rectangle(self.offset.x, self.offset.y, self.width, self.height)
+		else:
+			self._cctx.rectangle(area.min_pt.x, area.min_pt.y, area.width, area.height)
 		self._cctx.fill()
 
-	def compose_onto(self, destination, operator = "over"):
-		target = self.offset
+	def compose_onto(self, destination, operator = "over", color = None):
+		"""Composes this context onto the destination. When a color is given,
+		only the alpha channel is used and tinted in that color; this is how
+		masks are composed, which are tinted black by default."""
+		if (color is None) and self.is_mask:
+			color = (0, 0, 0)
 		destination.cctx.set_operator({
 			"over":		cairo.OPERATOR_OVER,
 			"xor":		cairo.OPERATOR_XOR,
@@ -130,8 +158,28 @@ class CairoContext():
 			"dest-in":	cairo.OPERATOR_DEST_IN,
 			"dest-out":	cairo.OPERATOR_DEST_OUT,
 		}[operator])
-		destination.cctx.set_source_surface(self.surface, self.offset.x, self.offset.y)
-		destination.cctx.paint()
+		if color is None:
+			destination.cctx.set_source_surface(self.surface, self.offset.x, self.offset.y)
+			destination.cctx.paint()
+		else:
+			destination.cctx.set_source_rgb(*color)
+			destination.cctx.mask_surface(self.surface, self.offset.x, self.offset.y)
+
+	def paint_at(self, source, position, invert_y_axis = False):
+		"""Copies the source context onto this one with its first pixel row at
+		the given pixel position, disregarding both offsets. With
+		invert_y_axis, the source is mirrored vertically."""
+		self._cctx.save()
+		self._cctx.identity_matrix()
+		if invert_y_axis:
+			self._cctx.translate(position.x, position.y + source.height)
+			self._cctx.scale(1, -1)
+		else:
+			self._cctx.translate(position.x, position.y)
+		self._cctx.set_operator(cairo.OPERATOR_OVER)
+		self._cctx.set_source_surface(source.surface, 0, 0)
+		self._cctx.paint()
+		self._cctx.restore()
 
 	def compose_all(self, sources):
 		for source in sources:
@@ -185,27 +233,254 @@ class CairoContext():
 		gip = GeoInterpolation(callback = lambda pt: self.blit_on_pixel(destination_ctx, pt))
 		gip.circle(center_pt_pixel, radius_px)
 
-	def draw_path(self, path, color = None, unit = "px"):
+	def fill_path(self, path, color = None, unit = "px"):
+		"""Fills a region, given as a list of moveto, lineto and arcto path
+		commands, with a single fill. Instead of converting every point to
+		pixels, the path is built in the given unit by scaling the
+		transformation matrix. Arcs that end where they start are full
+		circles."""
+		self._set_color(color)
+		matrix = self._cctx.get_matrix()
+		scale = self._to_pixel(1, unit)
+		self._cctx.scale(scale, scale)
+		(x, y) = (None, None)
+		for cmd in path:
+			(end_x, end_y) = (cmd.coord.x, cmd.coord.y)
+			if cmd.cmd == "lineto":
+				self._cctx.line_to(end_x, end_y)
+			elif cmd.cmd == "moveto":
+				self._cctx.move_to(end_x, end_y)
+			elif cmd.cmd == "arcto":
+				(center_x, center_y) = (cmd.center.x, cmd.center.y)
+				radius = math.hypot(x - center_x, y - center_y)
+				start_rad = math.atan2(y - center_y, x - center_x)
+				if (x, y) == (end_x, end_y):
+					end_rad = start_rad - 2 * math.pi if cmd.clockwise else start_rad + 2 * math.pi
+				else:
+					end_rad = math.atan2(end_y - center_y, end_x - center_x)
+				if cmd.clockwise:
+					self._cctx.arc_negative(center_x, center_y, radius, start_rad, end_rad)
+				else:
+					self._cctx.arc(center_x, center_y, radius, start_rad, end_rad)
+			(x, y) = (end_x, end_y)
+		self._cctx.set_matrix(matrix)
+		self._cctx.fill()
+
+	def _set_color(self, color):
 		if color is not None:
 			self._cctx.set_source_rgb(*color)
-		for cmd in path:
-			if cmd.cmd == "moveto":
-				point = self._to_pixel(cmd.coord, unit)
+
+	def stroke_line(self, start_pt, end_pt, width, color = None, unit = "px"):
+		"""Strokes a line with round caps, i.e., the area that is swept by a
+		circular aperture of the given diameter."""
+		start_pt_pixel = self._to_pixel(start_pt, unit)
+		end_pt_pixel = self._to_pixel(end_pt, unit)
+		self._set_color(color)
+		self._cctx.set_line_width(self._to_pixel(width, unit))
+		self._cctx.set_line_cap(cairo.LINE_CAP_ROUND)
+		self._cctx.move_to(start_pt_pixel.x, start_pt_pixel.y)
+		self._cctx.line_to(end_pt_pixel.x, end_pt_pixel.y)
+		self._cctx.stroke()
+
+	def fill_polygon(self, points, color = None, outline_width = None, unit = "px"):
+		"""Fills a closed polygon. When an outline width is given, the outline
+		is additionally stroked with round joins and caps, which grows the
+		polygon by half the outline width in every direction."""
+		self._set_color(color)
+		for (index, point) in enumerate(points):
+			point = self._to_pixel(point, unit)
+			if index == 0:
 				self._cctx.move_to(point.x, point.y)
-			elif cmd.cmd == "lineto":
-				point = self._to_pixel(cmd.coord, unit)
+			else:
 				self._cctx.line_to(point.x, point.y)
+		self._cctx.close_path()
+		if outline_width is None:
+			self._cctx.fill()
+		else:
+			self._cctx.fill_preserve()
+			self._cctx.set_line_width(self._to_pixel(outline_width, unit))
+			self._cctx.set_line_cap(cairo.LINE_CAP_ROUND)
+			self._cctx.set_line_join(cairo.LINE_JOIN_ROUND)
+			self._cctx.stroke()
+
+	def stroke_arc(self, start_pt, end_pt, center_pt, width, clockwise = False, color = None, unit = "px"):
+		"""Strokes a circular arc around the center point with round caps in
+		a single Cairo path. Without clockwise, the arc runs counter-clockwise
+		in Gerber coordinates (i.e., with increasing angle)."""
+		start_pt_pixel = self._to_pixel(start_pt, unit)
+		end_pt_pixel = self._to_pixel(end_pt, unit)
+		center_pt_pixel = self._to_pixel(center_pt, unit)
+		radius_px = (start_pt_pixel - center_pt_pixel).length
+		start_rad = (start_pt_pixel - center_pt_pixel).angle
+		end_rad = (end_pt_pixel - center_pt_pixel).angle
+
+		self._set_color(color)
+		self._cctx.set_line_width(self._to_pixel(width, unit))
+		self._cctx.set_line_cap(cairo.LINE_CAP_ROUND)
+		self._cctx.new_sub_path()
+		if not clockwise:
+			self._cctx.arc(center_pt_pixel.x, center_pt_pixel.y, radius_px, start_rad, end_rad)
+		else:
+			self._cctx.arc_negative(center_pt_pixel.x, center_pt_pixel.y, radius_px, start_rad, end_rad)
+		self._cctx.stroke()
+
+	def stroke_circle(self, center_pt, radius, width, color = None, unit = "px"):
+		center_pt_pixel = self._to_pixel(center_pt, unit)
+		radius_px = self._to_pixel(radius, unit)
+		self._set_color(color)
+		self._cctx.set_line_width(self._to_pixel(width, unit))
+		self._cctx.new_sub_path()
+		self._cctx.arc(center_pt_pixel.x, center_pt_pixel.y, radius_px, 0, 2 * math.pi)
+		self._cctx.close_path()
+		self._cctx.stroke()
+
+	def fill_circle(self, center_pt, radius, color = None, unit = "px"):
+		center_pt_pixel = self._to_pixel(center_pt, unit)
+		radius_px = self._to_pixel(radius, unit)
+		self._set_color(color)
+		self._cctx.new_sub_path()
+		self._cctx.arc(center_pt_pixel.x, center_pt_pixel.y, radius_px, 0, 2 * math.pi)
+		self._cctx.fill()
+
+	def fill_circles(self, center_pts, radius, color = None, unit = "px"):
+		"""Fills circles of identical radius around all center points as one
+		path with a single fill. Like fill_path(), the path is built in the
+		given unit by scaling the transformation matrix."""
+		self._set_color(color)
+		matrix = self._cctx.get_matrix()
+		scale = self._to_pixel(1, unit)
+		self._cctx.scale(scale, scale)
+		for point in center_pts:
+			self._cctx.new_sub_path()
+			self._cctx.arc(point.x, point.y, radius, 0, 2 * math.pi)
+		self._cctx.set_matrix(matrix)
+		self._cctx.fill()
+
+	def fill_rectangles(self, center_pts, width, height, color = None, unit = "px"):
+		"""Fills axis-aligned rectangles of identical size centered on all
+		points as one path with a single fill."""
+		self._set_color(color)
+		matrix = self._cctx.get_matrix()
+		scale = self._to_pixel(1, unit)
+		self._cctx.scale(scale, scale)
+		(half_width, half_height) = (width / 2, height / 2)
+		for point in center_pts:
+			self._cctx.rectangle(point.x - half_width, point.y - half_height, width, height)
+		self._cctx.set_matrix(matrix)
+		self._cctx.fill()
+
+	def stamp(self, source, positions):
+		"""Paints the source context with its top left corner at every
+		position, given in pixels in the coordinate system of this context.
+		Positions are rounded to whole pixels."""
+		for position in positions:
+			self._cctx.set_source_surface(source.surface, round(position.x), round(position.y))
+			self._cctx.paint()
+
+	def fill_instances(self, positions, path, color = None, unit = "px"):
+		"""Appends a Cairo path, given relative to the origin, at all positions
+		and fills all instances with a single fill."""
+		self._set_color(color)
+		matrix = self._cctx.get_matrix()
+		scale = self._to_pixel(1, unit)
+		for position in positions:
+			self._cctx.set_matrix(matrix)
+			self._cctx.scale(scale, scale)
+			self._cctx.translate(position.x, position.y)
+			self._cctx.append_path(path)
+		self._cctx.set_matrix(matrix)
 		self._cctx.fill()
 
+	def stroke_segments(self, center_pts, axis, width, color = None, unit = "px"):
+		"""Strokes the segments from point - axis to point + axis around all
+		center points with round caps as one path with a single stroke, i.e.,
+		draws obrounds of identical shape."""
+		self._set_color(color)
+		matrix = self._cctx.get_matrix()
+		scale = self._to_pixel(1, unit)
+		self._cctx.scale(scale, scale)
+		for point in center_pts:
+			self._cctx.move_to(point.x - axis.x, point.y - axis.y)
+			self._cctx.line_to(point.x + axis.x, point.y + axis.y)
+		# The line width is interpreted in the scaled user space, too
+		self._cctx.set_line_width(width)
+		self._cctx.set_line_cap(cairo.LINE_CAP_ROUND)
+		self._cctx.stroke()
+		self._cctx.set_matrix(matrix)
+
+	def pixel_array(self):
+		"""Returns a zero-copy NumPy view onto the surface buffer, indexed as
+		[y, x] for A8 and [y, x, channel] for ARGB32 surfaces. Channels are in
+		native byte order, i.e., B, G, R, A on little endian machines, see
+		CHANNELS. Callers that modify the array need to call mark_dirty()
+		afterwards."""
+		assert(numpy is not None)
+		self._surface.flush()
+		(height, stride) = (self._surface.get_height(), self._surface.get_stride())
+		if self._surface.get_format() == cairo.FORMAT_ARGB32:
+			return numpy.ndarray(shape = (height, stride // 4, 4), dtype = numpy.uint8, buffer = self._surface.get_data())
+		elif self._surface.get_format() == cairo.FORMAT_A8:
+			return numpy.ndarray(shape = (height, stride), dtype = numpy.uint8, buffer = self._surface.get_data())[:, : self.width]
+		else:
+			raise NotImplementedError(self._surface.get_format())
+
+	def mark_dirty(self):
+		self._surface.mark_dirty()
+
 	def alpha_polarize(self, threshold):
+		if self.is_mask:
+			return self._alpha_polarize_mask(threshold)
 		assert(self._surface.get_format() == cairo.FORMAT_ARGB32)
-		data = self._surface.get_data()
-		for offset in range(0, len(self._surface.get_data()), 4):
-			alpha = data[offset + 3]
-			if alpha > threshold:
-				data[offset + 3] = 0xff
-			else:
-				data[offset + 0] = 0x00
+		(blue, alpha) = (self.CHANNELS[0], self.CHANNELS[3])
+		if numpy is not None:
+			pixels = self.pixel_array()
+			opaque = pixels[:, :, alpha] > threshold
+			pixels[:, :, blue][~opaque] = 0x00
+			pixels[:, :, alpha][opaque] = 0xff
+			self.mark_dirty()
+		else:
+			self._surface.flush()
+			data = self._surface.get_data()
+			for offset in range(0, len(data), 4):
+				if data[offset + alpha] > threshold:
+					data[offset + alpha] = 0xff
+				else:
+					data[offset + blue] = 0x00
+			self.mark_dirty()
+
+	def _alpha_polarize_mask(self, threshold):
+		if numpy is not None:
+			pixels = self.pixel_array()
+			pixels[pixels > threshold] = 0xff
+			self.mark_dirty()
+		else:
+			self._surface.flush()
+			data = self._surface.get_data()
+			stride = self._surface.get_stride()
+			for y in range(self.height):
+				for offset in range(y * stride, (y * stride) + self.width):
+					if data[offset] > threshold:
+						data[offset] = 0xff
+			self.mark_dirty()
+
+	def to_buffer(self):
+		"""Serializes the raster data and placement of the context into a
+		picklable dictionary, e.g., to transfer it between processes."""
+		self._surface.flush()
+		return {
+			"format":	int(self._surface.get_format()),
+			"width":	self.width,
+			"height":	self.height,
+			"stride":	self._surface.get_stride(),
+			"data":		bytes(self._surface.get_data()),
+			"offset":	(self.offset.x, self.offset.y),
+			"dpi":		self.dpi,
+		}
+
+	@classmethod
+	def from_buffer(cls, buffer):
+		surface = cairo.ImageSurface.create_for_data(bytearray(buffer["data"]), cairo.Format(buffer["format"]), buffer["width"], buffer["height"], buffer["stride"])
+		return cls(dimensions = None, dpi = buffer["dpi"], offset = Vector2d(*buffer["offset"]), surface = surface)
 
 	def write_to_png(self, filename):
 		self._surface.write_to_png(filename)
@@ -0,0 +1,272 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import heapq
+import bisect
+import collections
+from .Vector2d import Vector2d
+from .Extents import Extents
+from .SpatialIndex import SpatialIndex
+
+class DisplayList():
+	"""Records the callbacks an interpreter issues while parsing a file. The
+	recorded primitives carry resolved apertures, polarity changes and
+	coordinates converted to inches, so replaying the display list onto any
+	callback is equivalent to interpreting the source file again. The exact
+	bounds of all primitives are accumulated while recording and available
+	without replaying. Optionally, every primitive is also entered into a
+	SpatialIndex along with its aperture and source line."""
+
+	def __init__(self, spatial_index = False):
+		self._ops = [ ]
+		self._boxes = [ ]
+		self._extents = Extents()
+		self._margin = None
+		self._region_start = None
+		self._region_extents = None
+		self._region_line = None
+		self._region_ends = { }
+		self._spatial_index = SpatialIndex() if spatial_index else None
+		self._unculled = None
+		self._selections = None
+		self._uses_clear = False
+		self._aperture = None
+		self._line = None
+
+	def _record(self, operation, *args):
+		self._ops.append((operation, args))
+		self._boxes.append(None)
+
+	def _record_drawing(self, box, operation, *args):
+		"""Records a primitive along with its bounds, a tuple of (minx, miny,
+		maxx, maxy) in inches."""
+		self._ops.append((operation, args))
+		self._boxes.append(box)
+		self._extents.add_box(*box)
+		if self._spatial_index is not None:
+			self._spatial_index.add(len(self._ops) - 1, operation, box, self._aperture, self._line)
+
+	def source_line(self, line):
+		self._line = line
+
+	def begin_path(self):
+		self._region_start = len(self._ops)
+		self._region_extents = Extents()
+		self._region_line = self._line
+		self._record("begin_path")
+
+	def region_move(self, point):
+		self._record("region_move", point)
+		self._extents.add_point(point)
+		self._region_extents.add_point(point)
+
+	def region_line(self, point):
+		self._record("region_line", point)
+		self._extents.add_point(point)
+		self._region_extents.add_point(point)
+
+	def region_arc(self, start_pt, end_pt, center_pt, clockwise):
+		self._record("region_arc", start_pt, end_pt, center_pt, clockwise)
+		self._extents.add_region_arc(start_pt, end_pt, center_pt, clockwise)
+		self._region_extents.add_region_arc(start_pt, end_pt, center_pt, clockwise)
+
+	def drawmode_clear(self):
+		self._uses_clear = True
+		self._record("drawmode_clear")
+
+	def drawmode_dark(self):
+		self._record("drawmode_dark")
+
+	def end_path(self):
+		self._record("end_path")
+		if self._region_start is not None:
+			self._region_ends[self._region_start] = len(self._ops) - 1
+			if not self._region_extents.empty:
+				# The whole region is culled at once, by the bounds stored for
+				# its begin_path
+				bounding_box = self._region_extents.bounding_box
+				box = (bounding_box.min_pt.x, bounding_box.min_pt.y, bounding_box.max_pt.x, bounding_box.max_pt.y)
+				self._boxes[self._region_start] = box
+				if self._spatial_index is not None:
+					self._spatial_index.add(self._region_start, "region", box, None, self._region_line)
+		self._region_start = None
+		self._region_extents = None
+
+	def close_contour(self):
+		self._record("close_contour")
+
+	def select_aperture(self, aperture_def):
+		self._record("select_aperture", aperture_def)
+		self._margin = aperture_def.extents
+		self._aperture = aperture_def
+
+	def circle(self, center_pt, radius):
+		self._record_drawing(Extents.circle_box(center_pt, radius, self._margin), "circle", center_pt, radius)
+
+	def arc_ccw(self, start_pt, end_pt, center_pt):
+		self._record_drawing(Extents.arc_box(start_pt, end_pt, center_pt, False, self._margin), "arc_ccw", start_pt, end_pt, center_pt)
+
+	def arc_cw(self, start_pt, end_pt, center_pt):
+		self._record_drawing(Extents.arc_box(start_pt, end_pt, center_pt, True, self._margin), "arc_cw", start_pt, end_pt, center_pt)
+
+	def line(self, start_pt, end_pt):
+		# Lines drawn before the current point was ever set start at their end
+		self._record_drawing(Extents.line_box(end_pt if (start_pt is None) else start_pt, end_pt, self._margin), "line", start_pt, end_pt)
+
+	def flash_at(self, point):
+		self._record_drawing(Extents.point_box(point, self._margin), "flash_at", point)
+
+	def drill(self, point):
+		self._record_drawing(Extents.point_box(point, self._margin), "drill", point)
+
+	def switch_drill_tool(self, diameter):
+		self._record("switch_drill_tool", diameter)
+		self._margin = Vector2d(diameter / 2, diameter / 2)
+		self._aperture = diameter
+
+	def step_repeat(self, block, offsets):
+		self._uses_clear = self._uses_clear or block.uses_clear
+		box = Extents.step_repeat_box(block.extents, offsets)
+		if box is None:
+			self._record("step_repeat", block, offsets)
+		else:
+			self._record_drawing(box, "step_repeat", block, offsets)
+
+	def finish(self):
+		# Replay finishes the callback by itself
+		if self._spatial_index is not None:
+			self._spatial_index.build()
+			(self._unculled, self._selections) = self._find_unculled_ops()
+
+	@property
+	def extents(self):
+		"""Bounding box of everything drawn in inches, including aperture
+		extents, or None if the display list has no content."""
+		return self._extents.bounding_box
+
+	@property
+	def spatial_index(self):
+		"""SpatialIndex over all primitives, regions and repeated blocks or None
+		if the display list was recorded without. The aperture of an entry is
+		the selected aperture definition, for drill hits the tool diameter in
+		inches."""
+		return self._spatial_index
+
+	@property
+	def uses_clear(self):
+		"""Tells if anything is drawn in clear polarity, including within
+		repeated blocks."""
+		return self._uses_clear
+
+	@property
+	def statistics(self):
+		return collections.Counter(operation for (operation, args) in self._ops)
+
+	def _find_unculled_ops(self):
+		"""Positions of all operations that a window never culls, i.e., state
+		changes outside of regions and regions or blocks without bounds, and
+		separately the positions of all aperture and drill tool selections.
+		Of the latter, only the one in effect for a visible primitive needs
+		to be replayed."""
+		(unculled, selections) = ([ ], [ ])
+		op_index = 0
+		while op_index < len(self._ops):
+			if self._ops[op_index][0] in ("select_aperture", "switch_drill_tool"):
+				selections.append(op_index)
+			elif self._boxes[op_index] is None:
+				unculled.append(op_index)
+			# Operations within a region are culled with it
+			op_index = self._region_ends.get(op_index, op_index) + 1
+		return (unculled, selections)
+
+	@staticmethod
+	def _visible_step_repeat(op, window):
+		(block, offsets) = op[1]
+		block_box = block.extents
+		if block_box is None:
+			return op
+		visible_offsets = [ offset for offset in offsets if (block_box.min_pt.x + offset.x <= window.max_pt.x) and (block_box.max_pt.x + offset.x >= window.min_pt.x) and (block_box.min_pt.y + offset.y <= window.max_pt.y) and (block_box.max_pt.y + offset.y >= window.min_pt.y) ]
+		return ("step_repeat", (block, visible_offsets))
+
+	def _visible_ops(self, window):
+		"""Yields all operations except primitives (and whole regions) that lie
+		completely outside the window. Repeated blocks are only repeated at
+		the offsets where they are visible."""
+		(window_minx, window_miny, window_maxx, window_maxy) = (window.min_pt.x, window.min_pt.y, window.max_pt.x, window.max_pt.y)
+		skip_region = False
+		for (op, box) in zip(self._ops, self._boxes):
+			if skip_region:
+				if op[0] == "end_path":
+					skip_region = False
+				continue
+			if box is None:
+				yield op
+			elif (box[0] > window_maxx) or (box[2] < window_minx) or (box[1] > window_maxy) or (box[3] < window_miny):
+				if op[0] == "begin_path":
+					skip_region = True
+			elif op[0] == "step_repeat":
+				yield self._visible_step_repeat(op, window)
+			else:
+				yield op
+
+	def _indexed_visible_ops(self, window):
+		"""Same as _visible_ops(), but only visits the visible primitives that
+		the spatial index returns, the state changes in between and only the
+		aperture selections in effect for the visible primitives."""
+		spatial_index = self._spatial_index
+		visible = [ spatial_index[entry_id].index for entry_id in spatial_index.intersecting(window.min_pt.x, window.min_pt.y, window.max_pt.x, window.max_pt.y) ]
+		selections = self._selections
+		selected = -1
+		for op_index in heapq.merge(self._unculled, visible):
+			selection = bisect.bisect_left(selections, op_index) - 1
+			if selection != selected:
+				selected = selection
+				yield self._ops[selections[selection]]
+			op = self._ops[op_index]
+			if op[0] == "begin_path":
+				yield from self._ops[op_index : self._region_ends.get(op_index, op_index) + 1]
+			elif op[0] == "step_repeat":
+				yield self._visible_step_repeat(op, window)
+			else:
+				yield op
+
+	def replay(self, callback, window = None):
+		"""Replays the recorded operations onto the callback. With a window
+		given, a BoundingBox in inches, primitives outside of it are culled."""
+		handlers = { }
+		if window is None:
+			ops = self._ops
+		elif self._unculled is not None:
+			ops = self._indexed_visible_ops(window)
+		else:
+			ops = self._visible_ops(window)
+		for (operation, args) in ops:
+			handler = handlers.get(operation)
+			if handler is None:
+				handler = getattr(callback, operation)
+				handlers[operation] = handler
+			handler(*args)
+		callback.finish()
+
+	def __len__(self):
+		return len(self._ops)
+
+	def __repr__(self):
+		return "DisplayList<%d operations>" % (len(self))
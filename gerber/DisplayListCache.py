@@ -0,0 +1,66 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import threading
+import collections
+
+class DisplayListCache():
+	"""LRU cache of parsed display lists, keyed by interpreter and the digest
+	of the source file contents. Unlike the per-Renderscript display lists it
+	outlives a single board, so that a long-running process does not parse
+	identical sources again. Safe to share between threads."""
+
+	def __init__(self, max_entries = 64):
+		self._max_entries = max_entries
+		self._cache = collections.OrderedDict()
+		self._lock = threading.Lock()
+		self._hits = 0
+		self._misses = 0
+
+	@property
+	def hits(self):
+		return self._hits
+
+	@property
+	def misses(self):
+		return self._misses
+
+	def get(self, key):
+		with self._lock:
+			display_list = self._cache.get(key)
+			if display_list is None:
+				self._misses += 1
+			else:
+				self._hits += 1
+				self._cache.move_to_end(key)
+			return display_list
+
+	def put(self, key, display_list):
+		with self._lock:
+			self._cache[key] = display_list
+			self._cache.move_to_end(key)
+			while len(self._cache) > self._max_entries:
+				self._cache.popitem(last = False)
+
+	def __len__(self):
+		return len(self._cache)
+
+	def __str__(self):
+		return "DisplayListCache<%d of %d entries used, %d hits, %d misses>" % (len(self), self._max_entries, self.hits, self.misses)
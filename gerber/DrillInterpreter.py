@@ -23,6 +23,8 @@ import collections
 import enum
 from .MultiRegex import MultiRegex
 from .Vector2d import Vector2d
+from .DisplayList import DisplayList
+from .SourceReader import SourceReader
 
 class EndOfFile(Exception): pass
 
@@ -50,8 +52,10 @@ class DrillInterpreter():
 		("unknown", re.compile(r"(?P<unknown>FMAT.*)")),
 	)))
 
-	def __init__(self, filename, callback):
-		self._filename = filename
+	def __init__(self, source, callback):
+		"""The source is a filename, a bytes-like buffer or a text or binary
+		stream."""
+		self._source = source
 		self._callback = callback
 		self._unit = None
 		self._tools = { }
@@ -59,18 +63,49 @@ class DrillInterpreter():
 		self._y = None
 		self._value_interpretation = ValueInterpretation.LiteralFloat
 		self._precision = None
+		self._coordinate_fmt = None
+
+	@classmethod
+	def parse(cls, source, spatial_index = False):
+		"""Interprets the source once and returns a replayable display list,
+		optionally with a spatial index over all primitives."""
+		display_list = DisplayList(spatial_index = spatial_index)
+		cls(source, display_list).run()
+		return display_list
+
+	def _coordinate_format(self):
+		"""Returns the value interpretation, the denominator and padding width
+		for decimal coordinates and the divisor to convert to inches. These are
+		cached until the unit or number format changes."""
+		if self._coordinate_fmt is None:
+			if self._unit == Unit.Inch:
+				unit_divisor = 1
+			elif self._unit == Unit.MM:
+				unit_divisor = 25.4
+			else:
+				raise NotImplementedError(self._unit)
+			if self._value_interpretation == ValueInterpretation.Decimal:
+				self._coordinate_fmt = (self._value_interpretation, 10 ** self._precision[1], self._precision[0] + self._precision[1], unit_divisor)
+			else:
+				self._coordinate_fmt = (self._value_interpretation, None, None, unit_divisor)
+		return self._coordinate_fmt
 
 	def _convert_coord(self, value):
-		if self._value_interpretation == ValueInterpretation.LiteralFloat:
-			value = float(value)
-		elif self._value_interpretation == ValueInterpretation.Decimal:
-			digits = self._precision[0] + self._precision[1]
-			value = value.ljust(digits, "0")
-			(pre, post) = (value[ : self._precision[0] ], value[self._precision[0] : ])
-			value = int(pre) + (int(post) / (10 ** self._precision[1]))
+		(value_interpretation, denominator, digits, unit_divisor) = self._coordinate_fmt or self._coordinate_format()
+		if value_interpretation == ValueInterpretation.LiteralFloat:
+			return float(value) / unit_divisor
+		elif value_interpretation == ValueInterpretation.Decimal:
+			# Trailing zeros are suppressed, pad them and decode as scaled integer
+			negative = value.startswith("-")
+			if negative:
+				value = value[1:]
+			(i, d) = divmod(int(value.ljust(digits, "0")), denominator)
+			value = i + (d / denominator)
+			if negative:
+				value = -value
+			return value / unit_divisor
 		else:
-			raise NotImplementedError(self._value_interpretation)
-		return self._to_inch(value)
+			raise NotImplementedError(value_interpretation)
 
 	def _to_inch(self, value):
 		if self._unit == Unit.Inch:
@@ -107,12 +142,14 @@ class DrillInterpreter():
 
 	def _match_unit(self, match):
 		self._unit = Unit(match["unit"])
+		self._coordinate_fmt = None
 		mode = match["mode"]
 		if mode is not None:
 			if mode.startswith("0"):
 				(pre, post) = mode.split(".", maxsplit = 1)
 				self._precision = (len(pre), len(post))
 				self._value_interpretation = ValueInterpretation.Decimal
+				self._coordinate_fmt = None
 
 	def _match_tooldef(self, match):
 		tool_id = int(match["t"])
@@ -152,15 +189,16 @@ class DrillInterpreter():
 		if key == "FILE_FORMAT":
 			self._precision = [ int(x) for x in value.split(":", maxsplit = 1) ]
 			self._value_interpretation = ValueInterpretation.Decimal
+			self._coordinate_fmt = None
 
 	def _interpret_line(self, line):
 		self._CMDS.fullmatch(line, self, groupdict = True)
 
 	def run(self):
-		with open(self._filename) as f:
-			try:
-				for line in f:
-					line = line.rstrip("\r\n")
-					self._interpret_line(line)
-			except EndOfFile:
-				pass
+		try:
+			for (lineno, line) in enumerate(SourceReader.read_text(self._source).splitlines(), 1):
+				self._callback.source_line(lineno)
+				self._interpret_line(line)
+		except EndOfFile:
+			pass
+		self._callback.finish()
@@ -0,0 +1,155 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import math
+from .Vector2d import Vector2d
+from .BoundingBox import BoundingBox
+
+class Extents():
+	"""Accumulates the exact axis-aligned bounds of primitives from their
+	parameters alone: segment endpoints, arc extrema where the arc crosses a
+	quadrant boundary and the half extents of the aperture that draws them.
+	Every primitive costs constant time, regardless of its size."""
+
+	def __init__(self):
+		self._minx = None
+		self._miny = None
+		self._maxx = None
+		self._maxy = None
+
+	def add_box(self, minx, miny, maxx, maxy):
+		if self._minx is None:
+			(self._minx, self._miny, self._maxx, self._maxy) = (minx, miny, maxx, maxy)
+		else:
+			if minx < self._minx:
+				self._minx = minx
+			if miny < self._miny:
+				self._miny = miny
+			if maxx > self._maxx:
+				self._maxx = maxx
+			if maxy > self._maxy:
+				self._maxy = maxy
+
+	@staticmethod
+	def point_box(point, margin = None):
+		if margin is None:
+			return (point.x, point.y, point.x, point.y)
+		return (point.x - margin.x, point.y - margin.y, point.x + margin.x, point.y + margin.y)
+
+	@staticmethod
+	def line_box(start_pt, end_pt, margin = None):
+		(minx, maxx) = (start_pt.x, end_pt.x) if (start_pt.x < end_pt.x) else (end_pt.x, start_pt.x)
+		(miny, maxy) = (start_pt.y, end_pt.y) if (start_pt.y < end_pt.y) else (end_pt.y, start_pt.y)
+		if margin is None:
+			return (minx, miny, maxx, maxy)
+		return (minx - margin.x, miny - margin.y, maxx + margin.x, maxy + margin.y)
+
+	@staticmethod
+	def circle_box(center_pt, radius, margin = None):
+		(rx, ry) = (radius, radius) if (margin is None) else (radius + margin.x, radius + margin.y)
+		return (center_pt.x - rx, center_pt.y - ry, center_pt.x + rx, center_pt.y + ry)
+
+	@staticmethod
+	def arc_box(start_pt, end_pt, center_pt, clockwise, margin = None):
+		"""Bounds of the arc from start to end around center. Besides both
+		endpoints, the arc's extrema are the points at 0, 90, 180 and 270
+		degrees that lie within its sweep."""
+		if clockwise:
+			(start_pt, end_pt) = (end_pt, start_pt)
+		radius = math.hypot(start_pt.x - center_pt.x, start_pt.y - center_pt.y)
+		start_angle = math.atan2(start_pt.y - center_pt.y, start_pt.x - center_pt.x)
+		sweep = (math.atan2(end_pt.y - center_pt.y, end_pt.x - center_pt.x) - start_angle) % (2 * math.pi)
+
+		(minx, miny, maxx, maxy) = Extents.line_box(start_pt, end_pt)
+		for quadrant in range(4):
+			if ((quadrant * math.pi / 2 - start_angle) % (2 * math.pi)) <= sweep:
+				if quadrant == 0:
+					maxx = max(maxx, center_pt.x + radius)
+				elif quadrant == 1:
+					maxy = max(maxy, center_pt.y + radius)
+				elif quadrant == 2:
+					minx = min(minx, center_pt.x - radius)
+				else:
+					miny = min(miny, center_pt.y - radius)
+		if margin is None:
+			return (minx, miny, maxx, maxy)
+		return (minx - margin.x, miny - margin.y, maxx + margin.x, maxy + margin.y)
+
+	def add_point(self, point, margin = None):
+		self.add_box(*self.point_box(point, margin))
+
+	def add_line(self, start_pt, end_pt, margin = None):
+		if start_pt is None:
+			# Drawn before the current point was ever set
+			start_pt = end_pt
+		self.add_box(*self.line_box(start_pt, end_pt, margin))
+
+	def add_circle(self, center_pt, radius, margin = None):
+		self.add_box(*self.circle_box(center_pt, radius, margin))
+
+	@staticmethod
+	def step_repeat_box(block_box, offsets):
+		"""Bounds of a block (given by its BoundingBox or None if empty)
+		repeated at all offsets, None for an empty block."""
+		if block_box is None:
+			return None
+		(min_dx, max_dx) = (min(offset.x for offset in offsets), max(offset.x for offset in offsets))
+		(min_dy, max_dy) = (min(offset.y for offset in offsets), max(offset.y for offset in offsets))
+		return (block_box.min_pt.x + min_dx, block_box.min_pt.y + min_dy, block_box.max_pt.x + max_dx, block_box.max_pt.y + max_dy)
+
+	@staticmethod
+	def region_arc_box(start_pt, end_pt, center_pt, clockwise):
+		"""Arc segment of a region contour; one that ends where it starts is a
+		full circle."""
+		if start_pt == end_pt:
+			return Extents.circle_box(center_pt, (start_pt - center_pt).length)
+		return Extents.arc_box(start_pt, end_pt, center_pt, clockwise)
+
+	def add_step_repeat(self, block_box, offsets):
+		box = self.step_repeat_box(block_box, offsets)
+		if box is not None:
+			self.add_box(*box)
+
+	def add_region_arc(self, start_pt, end_pt, center_pt, clockwise):
+		self.add_box(*self.region_arc_box(start_pt, end_pt, center_pt, clockwise))
+
+	def add_arc(self, start_pt, end_pt, center_pt, clockwise, margin = None):
+		self.add_box(*self.arc_box(start_pt, end_pt, center_pt, clockwise, margin))
+
+	@property
+	def empty(self):
+		return self._minx is None
+
+	@property
+	def min_pt(self):
+		return None if self.empty else Vector2d(self._minx, self._miny)
+
+	@property
+	def max_pt(self):
+		return None if self.empty else Vector2d(self._maxx, self._maxy)
+
+	@property
+	def bounding_box(self):
+		"""The accumulated bounds as BoundingBox or None if nothing was
+		added."""
+		return None if self.empty else BoundingBox(self.min_pt, self.max_pt)
+
+	def __repr__(self):
+		return "Extents<%s to %s>" % (self.min_pt, self.max_pt)
@@ -0,0 +1,59 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+
+class GerberTokenizer():
+	"""Splits RS-274X data into commands independent of line breaks. Regular
+	commands are terminated by '*'. Extended commands are enclosed in '%' and
+	consist of one or more '*'-terminated words, e.g., an aperture macro
+	definition. Both may share a line or span several lines."""
+	_TOKEN_RE = re.compile(r"%(?P<extended>[^%]*)%|(?P<word>[^%*]*)\*")
+
+	def __init__(self, text):
+		text = text.replace("\r", "")
+		# Offsets in the joined text at which each new source line starts
+		self._line_starts = [ match.start() - lineno for (lineno, match) in enumerate(re.finditer("\n", text)) ]
+		self._text = text.replace("\n", "")
+
+	def _tokens(self):
+		for match in self._TOKEN_RE.finditer(self._text):
+			extended = match.group("extended")
+			if extended is not None:
+				yield (match.end(), True, [ word for word in extended.split("*") if word != "" ])
+			else:
+				yield (match.end(), False, match.group("word"))
+
+	def __iter__(self):
+		"""Yields tuples of (extended, content). For extended commands content
+		is the list of words inside the '%' block, for regular commands it is
+		the single word. Terminating '*' characters are stripped."""
+		for (end, extended, content) in self._tokens():
+			yield (extended, content)
+
+	def with_lines(self):
+		"""Like iterating, but yields tuples of (line, extended, content) where
+		line is the 1-based source line on which the command ends."""
+		line_starts = self._line_starts
+		(line, count) = (1, len(line_starts))
+		for (end, extended, content) in self._tokens():
+			while (line <= count) and (line_starts[line - 1] < end):
+				line += 1
+			yield (line, extended, content)
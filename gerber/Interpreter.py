@@ -19,10 +19,14 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import re
-import collections
 import enum
-from .MultiRegex import MultiRegex
+from .MultiRegex import NoRegexMatchedException
+from .GerberTokenizer import GerberTokenizer
+from .SourceReader import SourceReader
 from .Vector2d import Vector2d
+from .DisplayList import DisplayList
+from .ApertureMacroCompiler import ApertureMacroCompiler
+from .ApertureMacroShape import ApertureMacroShape
 
 class InterpolationMode(enum.IntEnum):
 	Linear = 1
@@ -33,16 +37,6 @@ class Unit(enum.IntEnum):
 	Inch = 70
 	MM = 71
 
-class ApertureMacroPrimitiveCode(enum.IntEnum):
-	Comment = 0
-	Circle = 1
-	VectorLine = 20
-	CenterLine = 21
-	Outline = 4
-	Polygon = 5
-	Moire = 6
-	Thermal = 7
-
 class QuadrantMode(enum.IntEnum):
 	SingleQuadrant = 74
 	MultiQuadrant = 75
@@ -66,88 +60,179 @@ class ApertureDefinition():
 	def params(self):
 		return self._params
 
+	@property
+	def extents(self):
+		"""Half width and half height of the aperture's bounding box."""
+		if self.template in [ "C", "P" ]:
+			# Circle or polygon, given by (circumscribed) diameter
+			return Vector2d(self.params[0] / 2, self.params[0] / 2)
+		elif self.template in [ "R", "O" ]:
+			return Vector2d(self.params[0] / 2, self.params[1] / 2)
+		else:
+			raise NotImplementedError(self.template)
+
 	def __repr__(self):
 		return "Aperture<%s, %s>" % (self._template, self._params)
 
 class ApertureMacro():
+	"""Definition of an aperture macro. The body is compiled on first use and
+	the shape of every instance, i.e., parameter tuple, is only computed
+	once."""
 	def __init__(self, name):
 		self._name = name
-		self._commands = [ ]
+		self._words = [ ]
+		self._evaluate = None
+		self._shapes = { }
 
-	@property
-	def is_macro(self):
-		return True
+	def __getstate__(self):
+		# The compiled function cannot be pickled, recompile when needed
+		state = dict(self.__dict__)
+		state["_evaluate"] = None
+		return state
 
-	def append(self, command):
-		self._commands.append(command)
+	def append(self, word):
+		self._words.append(word)
+		self._evaluate = None
+		self._shapes = { }
 
 	@property
 	def name(self):
 		return self._name
 
 	@property
-	def commands(self):
-		return self._commands
+	def words(self):
+		return tuple(self._words)
+
+	def evaluate(self, params):
+		"""Returns the list of (primitive code, parameter values) tuples for
+		the given aperture parameters, in the unit of the Gerber file."""
+		if self._evaluate is None:
+			self._evaluate = ApertureMacroCompiler(self.name, self._words).compile()
+		return self._evaluate(params)
+
+	def shape(self, params, scale):
+		"""Returns the ApertureMacroShape for the given parameters in inches,
+		where scale converts from the Gerber file unit to inches."""
+		key = (params, scale)
+		shape = self._shapes.get(key)
+		if shape is None:
+			shape = ApertureMacroShape(self.evaluate(params), scale = scale)
+			self._shapes[key] = shape
+		return shape
 
 	def __iter__(self):
-		return iter(self._commands)
+		return iter(self._words)
 
 	def __repr__(self):
-		return "ApertureMacro<%s: %s>" % (self.name, str(self.commands))
+		return "ApertureMacro<%s: %s>" % (self.name, str(self._words))
+
+class ApertureMacroInstance():
+	"""An aperture defined by an aperture macro and its parameters. Used
+	just like an ApertureDefinition."""
+	def __init__(self, macro, params, scale):
+		self._macro = macro
+		self._params = params
+		self._scale = scale
 
-class ApertureMacroCommand():
-	def __init__(self, primitive_code, parameters):
-		assert(isinstance(primitive_code, ApertureMacroPrimitiveCode))
-		self._primitive_code = primitive_code
-		self._parameters = parameters
+	@property
+	def is_macro(self):
+		return True
+
+	@property
+	def macro(self):
+		return self._macro
+
+	@property
+	def name(self):
+		return self._macro.name
+
+	@property
+	def params(self):
+		return self._params
+
+	@property
+	def scale(self):
+		return self._scale
 
 	@property
-	def primitive_code(self):
-		return self._primitive_code
+	def shape(self):
+		return self._macro.shape(self._params, self._scale)
 
 	@property
-	def parameters(self):
-		return self._parameters
+	def extents(self):
+		"""Half width and half height of the aperture's bounding box."""
+		return self.shape.extents
 
 	def __repr__(self):
-		return "ApertureMacroCommand<%s, %s>" % (self.primitive_code.name, str(self.parameters))
+		return "ApertureMacroInstance<%s, %s>" % (self.name, self._params)
 
 class Interpreter():
-	_CMDS = MultiRegex(collections.OrderedDict((
-		("D", re.compile(r"D(?P<d>\d+)\*")),
-		("set_unit", re.compile(r"%MO(?P<unit>IN|MM)\*%")),
-		("set_precision", re.compile(r"%FSLAX(?P<xi>\d)(?P<xd>\d)Y(?P<yi>\d)(?P<yd>\d)\*%")),
-		("add_aperture", re.compile(r"%ADD(?P<d>\d{2})(?P<template>[^,]+),(?P<params>.*)\*%")),
-		("img_polarity", re.compile(r"%IP(?P<pol>POS|NEG)\*%")),
-		("offset", re.compile(r"%OFA(?P<a>\d+(\.\d+)?)B(?P<b>\d+(\.\d+)?)\*%")),
-		("cmd", re.compile(r"(?P<cmds>[-GDXYIJ0-9]+)\*")),
-		("key_value", re.compile(r"G04 (?P<key>\w+)=(?P<value>\w+)\*")),
-		("comment", re.compile(r"G04(?P<spacer>\s)?(?P<comment>.*)\*")),
-		("M", re.compile(r"M(?P<m>\d+)\*")),
-		("load_polarity", re.compile(r"%LP(?P<pol>[CD])\*%")),
-		("aperture_macro_start", re.compile(r"%AM(?P<name>[A-Za-z0-9]+)\*")),
-		("aperture_macro_definition", re.compile(r"(?P<params>[-.,0-9]+)\*")),
-		("aperture_macro_end", re.compile(r"%")),
-		("assign_aperture_macro", re.compile(r"%ADD(?P<d>\d{2})(?P<macro_name>[A-Za-z0-9]+)\*%")),
-		("not_implemented", re.compile(r"(?P<unknown_command>%.*)")),
-		("empty_command", re.compile(r"\*")),
-	)))
 	_CMD_RE = re.compile("(?P<cmdcode>[A-Z])(?P<parameter>-?[0-9]+)")
 
-	def __init__(self, filename, callback):
-		self._filename = filename
+	# Regular expressions for words produced by the GerberTokenizer, i.e.,
+	# without '*' terminator and '%' delimiters.
+	_D_RE = re.compile(r"D(?P<d>\d+)")
+	_M_RE = re.compile(r"M(?P<m>\d+)")
+	_CMDS_RE = re.compile(r"(?P<cmds>[-GDXYIJ0-9]+)")
+	_KEY_VALUE_RE = re.compile(r"G04 (?P<key>\w+)=(?P<value>\w+)")
+	_COMMENT_RE = re.compile(r"G04(?P<spacer>\s)?(?P<comment>.*)")
+	_EXTENDED_CMDS = {
+		"MO":	[ ("set_unit", re.compile(r"MO(?P<unit>IN|MM)")) ],
+		"FS":	[ ("set_precision", re.compile(r"FSLAX(?P<xi>\d)(?P<xd>\d)Y(?P<yi>\d)(?P<yd>\d)")) ],
+		"AD":	[
+					("add_aperture", re.compile(r"ADD(?P<d>\d+)(?P<template>[^,]+),(?P<params>.*)")),
+					("assign_aperture_macro", re.compile(r"ADD(?P<d>\d+)(?P<macro_name>[A-Za-z0-9_.$]+)")),
+				],
+		"IP":	[ ("img_polarity", re.compile(r"IP(?P<pol>POS|NEG)")) ],
+		"OF":	[ ("offset", re.compile(r"OFA(?P<a>\d+(\.\d+)?)B(?P<b>\d+(\.\d+)?)")) ],
+		"LP":	[ ("load_polarity", re.compile(r"LP(?P<pol>[CD])")) ],
+		"SR":	[ ("step_repeat", re.compile(r"SR(X(?P<x>\d+)Y(?P<y>\d+)I(?P<i>[-+]?[.0-9]+)J(?P<j>[-+]?[.0-9]+))?")) ],
+	}
+	_AM_RE = re.compile(r"AM(?P<name>[A-Za-z0-9_.$]+)")
+
+	def __init__(self, source, callback):
+		"""The source is a filename, a bytes-like buffer or a text or binary
+		stream."""
+		self._source = source
 		self._callback = callback
 		self._unit = None
 		self._interpolation = InterpolationMode.Linear
 		self._quadrantmode = QuadrantMode.MultiQuadrant
 		self._pos = None
 		self._precision = { "x": None, "y": None }
+		self._coordinate_fmt = None
 		self._apertures = { }
 		self._aperture_macros = { }
 		self._current_aperture_macro = None
 		self._region = False
+		self._aperture = None
+		self._polarity_clear = False
+		self._step_repeat = None
 		self._properties = { }
 
+		# Bind all handlers once; regular commands are dispatched by their
+		# first character, extended commands by their two letter code.
+		self._word_handlers = {
+			"D":	self._interpret_word_D,
+			"G":	self._interpret_word_G,
+			"M":	self._interpret_word_M,
+			"X":	self._interpret_word_cmd,
+			"Y":	self._interpret_word_cmd,
+			"I":	self._interpret_word_cmd,
+			"J":	self._interpret_word_cmd,
+		}
+		self._extended_handlers = {
+			code: [ (regex, getattr(self, "_match_" + name)) for (name, regex) in alternatives ] for (code, alternatives) in self._EXTENDED_CMDS.items()
+		}
+
+	@classmethod
+	def parse(cls, source, spatial_index = False):
+		"""Interprets the source once and returns a replayable display list,
+		optionally with a spatial index over all primitives."""
+		display_list = DisplayList(spatial_index = spatial_index)
+		cls(source, display_list).run()
+		return display_list
+
 	def _begin_region(self):
 		assert(not self._region)
 		self._region = True
@@ -158,22 +243,33 @@ class Interpreter():
 		self._region = False
 		self._callback.end_path()
 
-	def _convert(self, value, coord_fmt):
-		if value is None:
-			return None
+	@staticmethod
+	def _decode(value, denominator):
+		"""Decodes a coordinate from its scaled integer representation. Splitting
+		into integral and fractional part (instead of dividing the scaled
+		integer directly) gives bit-identical results to the previous string
+		based conversion."""
+		value = int(value)
+		if value >= 0:
+			(i, d) = divmod(value, denominator)
+			return i + (d / denominator)
 		else:
-			negative = False
-			if value[0] == "-":
-				negative = True
-				value = value[1:]
-			digits = coord_fmt[0] + coord_fmt[1]
-			value = value.rjust(digits, "0")
-			(i, d) = (value[:coord_fmt[0]], value[coord_fmt[0]:])
-			denominator = 10 ** coord_fmt[1]
-			value = int(i) + (int(d) / denominator)
-			if negative:
-				return -value
-			return value
+			(i, d) = divmod(-value, denominator)
+			return -(i + (d / denominator))
+
+	def _coordinate_format(self):
+		"""Returns the per-file coordinate decoding parameters, i.e., the
+		denominators of X and Y and the divisor that converts to inches. They
+		are cached until unit or precision change."""
+		if self._coordinate_fmt is None:
+			if self._unit == Unit.Inch:
+				unit_divisor = 1
+			elif self._unit == Unit.MM:
+				unit_divisor = 25.4
+			else:
+				raise NotImplementedError(self._unit)
+			self._coordinate_fmt = (10 ** self._precision["x"][1], 10 ** self._precision["y"][1], unit_divisor)
+		return self._coordinate_fmt
 
 	def _to_inches(self, value):
 		if value is None:
@@ -185,9 +281,6 @@ class Interpreter():
 		else:
 			raise NotImplementedError(self._unit)
 
-	def _match_empty_command(self, match):
-		pass
-
 	def _match_not_implemented(self, match):
 		print("Not implemented:", match)
 
@@ -196,16 +289,13 @@ class Interpreter():
 		self._aperture_macros[self._current_aperture_macro.name] = self._current_aperture_macro
 
 	def _match_aperture_macro_definition(self, match):
-		args = match["params"].split(",")
-		primitive_code = ApertureMacroPrimitiveCode(int(args[0]))
-		parameters = args[1:]
-		self._current_aperture_macro.append(ApertureMacroCommand(primitive_code, parameters))
+		self._current_aperture_macro.append(match["params"])
 
 	def _match_aperture_macro_end(self, match):
 		self._current_aperture_macro = None
 
 	def _match_assign_aperture_macro(self, match):
-		self._apertures[int(match["d"])] = self._aperture_macros[match["macro_name"]]
+		self._apertures[int(match["d"])] = ApertureMacroInstance(self._aperture_macros[match["macro_name"]], params = ( ), scale = self._to_inches(1))
 
 	def _match_img_polarity(self, match):
 		if match["pol"] != "POS":
@@ -213,6 +303,7 @@ class Interpreter():
 
 	def _match_load_polarity(self, match):
 		pol = match["pol"]
+		self._polarity_clear = (pol == "C")
 		if pol == "C":
 			# Clear
 			self._callback.drawmode_clear()
@@ -220,36 +311,69 @@ class Interpreter():
 			# Dark
 			self._callback.drawmode_dark()
 
-	def _match_cmd(self, match):
-		orig_cmds = match["cmds"]
-		remaining = orig_cmds
+	def _select_aperture(self, aperture):
+		self._aperture = aperture
+		self._callback.select_aperture(aperture)
+
+	def _begin_step_repeat(self, offsets):
+		"""Everything up to the end of the block is recorded into a display
+		list of its own, which the callback then repeats at all offsets."""
+		self._step_repeat = (self._callback, offsets, self._aperture, self._polarity_clear)
+		self._callback = DisplayList()
+		if self._aperture is not None:
+			self._callback.select_aperture(self._aperture)
+		if self._polarity_clear:
+			self._callback.drawmode_clear()
 
+	def _end_step_repeat(self):
+		(callback, offsets, aperture, polarity_clear) = self._step_repeat
+		block = self._callback
+		self._callback = callback
+		self._step_repeat = None
+		if len(block) > 0:
+			self._callback.step_repeat(block, offsets)
+		# Carry over state changes that happened inside the block
+		if (self._aperture is not None) and (self._aperture is not aperture):
+			self._callback.select_aperture(self._aperture)
+		if self._polarity_clear != polarity_clear:
+			if self._polarity_clear:
+				self._callback.drawmode_clear()
+			else:
+				self._callback.drawmode_dark()
+
+	def _match_step_repeat(self, match):
+		if self._step_repeat is not None:
+			self._end_step_repeat()
+		if match["x"] is not None:
+			(x_repeats, y_repeats) = (int(match["x"]), int(match["y"]))
+			(x_step, y_step) = (self._to_inches(float(match["i"])), self._to_inches(float(match["j"])))
+			if (x_repeats * y_repeats) > 1:
+				self._begin_step_repeat([ Vector2d(x * x_step, y * y_step) for y in range(y_repeats) for x in range(x_repeats) ])
+
+	def _execute_cmds(self, orig_cmds):
 		parameters = { }
-		while len(remaining) > 0:
-			match = self._CMD_RE.match(remaining)
-			if not match:
-				raise Exception("Could not match remaining '%s' in '%s'." % (remaining, orig_cmds))
-			cmd = match.groupdict()
-			remaining = remaining[match.span()[1]: ]
-
-			cmdcode = cmd["cmdcode"]
-			param = cmd["parameter"]
+		consumed = 0
+		for (cmdcode, param) in self._CMD_RE.findall(orig_cmds):
+			consumed += len(cmdcode) + len(param)
 			if cmdcode == "G":
 				self._execute_G(int(param))
+			elif (cmdcode == "D") and (int(param) >= 10):
+				# Aperture selection, possibly with deprecated G54 prefix
+				self._match_D({ "d": param })
 			elif cmdcode == "D":
 				parameters[cmdcode] = param
 				self._execute_D(parameters)
 				parameters = { }
 			else:
 				parameters[cmdcode] = param
+		if consumed != len(orig_cmds):
+			raise Exception("Could not match all of '%s'." % (orig_cmds))
 
 	def _execute_D(self, match):
-		x = self._convert(match.get("X"), self._precision["x"])
-		y = self._convert(match.get("Y"), self._precision["y"])
-		i = self._convert(match.get("I"), self._precision["x"])
-		j = self._convert(match.get("J"), self._precision["y"])
-		xy = Vector2d(self._to_inches(x) if x is not None else self._pos.x, self._to_inches(y) if y is not None else self._pos.y)
-		ij = Vector2d(self._to_inches(i) if i is not None else 0, self._to_inches(j) if j is not None else 0)
+		(x_denominator, y_denominator, unit_divisor) = self._coordinate_fmt or self._coordinate_format()
+		(x, y, i, j) = (match.get("X"), match.get("Y"), match.get("I"), match.get("J"))
+		xy = Vector2d(self._decode(x, x_denominator) / unit_divisor if x is not None else self._pos.x, self._decode(y, y_denominator) / unit_divisor if y is not None else self._pos.y)
+		ij = Vector2d(self._decode(i, x_denominator) / unit_divisor if i is not None else 0, self._decode(j, y_denominator) / unit_divisor if j is not None else 0)
 		d = int(match["D"])
 		if self._interpolation == InterpolationMode.Linear:
 			if d == 1:
@@ -269,7 +393,9 @@ class Interpreter():
 			start_pt = self._pos
 			end_pt = xy
 			center_pt = start_pt + ij
-			if (d == 1) and (start_pt == end_pt):
+			if (d == 1) and self._region:
+				self._callback.region_arc(start_pt = start_pt, end_pt = end_pt, center_pt = center_pt, clockwise = (self._interpolation == InterpolationMode.ClockwiseCircular))
+			elif (d == 1) and (start_pt == end_pt):
 				# Full circle
 				radius = (center_pt - start_pt).length
 				self._callback.circle(center_pt, radius)
@@ -277,6 +403,11 @@ class Interpreter():
 				self._callback.arc_cw(start_pt = start_pt, end_pt = end_pt, center_pt = center_pt)
 			elif (d == 1) and (self._interpolation == InterpolationMode.CounterClockwiseCircular):
 				self._callback.arc_ccw(start_pt = start_pt, end_pt = end_pt, center_pt = center_pt)
+			elif d == 2:
+				if self._region:
+					self._callback.region_move(end_pt)
+			elif d == 3:
+				self._callback.flash_at(end_pt)
 			else:
 				raise NotImplementedError(self._interpolation, self._quadrantmode, match)
 			self._pos = end_pt
@@ -294,12 +425,19 @@ class Interpreter():
 
 	def _match_add_aperture(self, match):
 		template = match["template"]
-		params = tuple(self._to_inches(float(value)) for value in match["params"].split("X"))
-		aperture = ApertureDefinition(template = template, params = params)
+		if template in self._aperture_macros:
+			# Macro parameters are not necessarily lengths, they are converted
+			# after the macro has been evaluated
+			params = tuple(float(value) for value in match["params"].split("X"))
+			aperture = ApertureMacroInstance(self._aperture_macros[template], params = params, scale = self._to_inches(1))
+		else:
+			params = tuple(self._to_inches(float(value)) for value in match["params"].split("X"))
+			aperture = ApertureDefinition(template = template, params = params)
 		d = int(match["d"])
 		self._apertures[d] = aperture
 
 	def _match_set_unit(self, match):
+		self._coordinate_fmt = None
 		if match["unit"] == "MM":
 			self._unit = Unit.MM
 		elif match["unit"] == "IN":
@@ -312,6 +450,7 @@ class Interpreter():
 			self._interpolation = InterpolationMode(g)
 		elif g in [ 70, 71 ]:
 			self._unit = Unit(g)
+			self._coordinate_fmt = None
 		elif g in [ 74, 75 ]:
 			self._quadrantmode = QuadrantMode(g)
 		elif g == 36:
@@ -339,9 +478,9 @@ class Interpreter():
 			if not d in self._apertures:
 				print("Warning: Missing aperture %d" % (d))
 				missing_aperture = ApertureDefinition(template = "C", params = (0.001, ))
-				self._callback.select_aperture(missing_aperture)
+				self._select_aperture(missing_aperture)
 			else:
-				self._callback.select_aperture(self._apertures[d])
+				self._select_aperture(self._apertures[d])
 		else:
 			print(match)
 
@@ -359,15 +498,80 @@ class Interpreter():
 	def _match_set_precision(self, match):
 		self._precision["x"] = (int(match["xi"]), int(match["xd"]))
 		self._precision["y"] = (int(match["yi"]), int(match["yd"]))
+		self._coordinate_fmt = None
+
+	def _interpret_word_cmd(self, word):
+		if self._CMDS_RE.fullmatch(word) is None:
+			raise NoRegexMatchedException("No regex matched: %s" % (word))
+		self._execute_cmds(word)
+
+	def _interpret_word_D(self, word):
+		match = self._D_RE.fullmatch(word)
+		if match is not None:
+			self._match_D(match.groupdict())
+		else:
+			self._interpret_word_cmd(word)
+
+	def _interpret_word_G(self, word):
+		if word.startswith("G04"):
+			match = self._KEY_VALUE_RE.fullmatch(word)
+			if match is not None:
+				self._match_key_value(match.groupdict())
+			else:
+				self._match_comment(self._COMMENT_RE.fullmatch(word).groupdict())
+		else:
+			self._interpret_word_cmd(word)
+
+	def _interpret_word_M(self, word):
+		match = self._M_RE.fullmatch(word)
+		if match is None:
+			raise NoRegexMatchedException("No regex matched: %s" % (word))
+		self._match_M(match.groupdict())
+
+	def _interpret_word(self, word):
+		if word == "":
+			return
+		handler = self._word_handlers.get(word[0])
+		if handler is None:
+			raise NoRegexMatchedException("No regex matched: %s" % (word))
+		handler(word)
+
+	def _interpret_extended(self, words):
+		if len(words) == 0:
+			return
+		if words[0].startswith("AM"):
+			# Aperture macro, all following words are the macro body
+			self._match_aperture_macro_start(self._AM_RE.fullmatch(words[0]).groupdict())
+			for word in words[1:]:
+				self._match_aperture_macro_definition({ "params": word })
+			self._match_aperture_macro_end(None)
+			return
+
+		for word in words:
+			for (regex, handler) in self._extended_handlers.get(word[:2], [ ]):
+				match = regex.fullmatch(word)
+				if match is not None:
+					handler(match.groupdict())
+					break
+			else:
+				self._match_not_implemented({ "unknown_command": "%" + word + "*%" })
+
+	def _run_text(self, text):
+		for (line, extended, content) in GerberTokenizer(text).with_lines():
+			self._callback.source_line(line)
+			if extended:
+				self._interpret_extended(content)
+			else:
+				self._interpret_word(content)
 
-	def _interpret_line(self, line):
-		self._CMDS.fullmatch(line, self, groupdict = True)
+	def _finish(self):
+		if self._step_repeat is not None:
+			self._end_step_repeat()
+		self._callback.finish()
 
 	def run(self):
 		try:
-			with open(self._filename) as f:
-				for line in f:
-					line = line.rstrip("\r\n")
-					self._interpret_line(line)
+			self._run_text(SourceReader.read_text(self._source))
 		except EndOfFile:
 			pass
+		self._finish()
@@ -23,13 +23,15 @@ import cairo
 import collections
 from .CairoContext import CairoContext
 from .Vector2d import Vector2d
+from .BoundingBox import BoundingBox
 from .ApertureRenderer import ApertureRenderer
-from .GeoInterpolation import GeoInterpolation
+from .ApertureCache import ApertureCache
+from .Extents import Extents
 
 class BaseCallback():
 	_MoveToCmd = collections.namedtuple("PathCommandMoveTo", [ "cmd", "coord" ])
 	_LineToCmd = collections.namedtuple("PathCommandLineTo", [ "cmd", "coord" ])
-	_ArcToCmd = collections.namedtuple("PathCommandArcTo", [ "cmd", "TODO" ])
+	_ArcToCmd = collections.namedtuple("PathCommandArcTo", [ "cmd", "coord", "center", "clockwise" ])
 
 	def __init__(self):
 		self._path = [ ]
@@ -43,9 +45,11 @@ class BaseCallback():
 	def region_line(self, point):
 		self._path.append(self._LineToCmd(cmd = "lineto", coord = point))
 
-	def region_arc(self, TODO):
-		self._path.append(self._ArcToCmd(cmd = "arcto", coord = point))
-		raise NotImplementedError("arcto")
+	def region_arc(self, start_pt, end_pt, center_pt, clockwise):
+		if len(self._path) == 0:
+			# Contour starts at the current point
+			self.region_move(start_pt)
+		self._path.append(self._ArcToCmd(cmd = "arcto", coord = end_pt, center = center_pt, clockwise = clockwise))
 
 	def drawmode_clear(self):
 		pass
@@ -83,114 +87,239 @@ class BaseCallback():
 	def switch_drill_tool(self, diameter):
 		pass
 
+	def step_repeat(self, block, offsets):
+		pass
+
+	def source_line(self, line):
+		"""Called with the source line number before each command is
+		interpreted."""
+		pass
+
+	def finish(self):
+		pass
+
 class CairoCallback(BaseCallback):
-	def __init__(self, cairo_context, src_color = None):
+	RENDER_MODES = ( "vector", "blit" )
+
+	def __init__(self, cairo_context, src_color = None, render_mode = "vector", aperture_cache = None, profiler = None):
 		BaseCallback.__init__(self)
+		assert(render_mode in self.RENDER_MODES)
 		self._cctx = cairo_context
 		if src_color is None:
 			self._src_color = (0, 0, 0)
 		else:
 			self._src_color = src_color
+		self._render_mode = render_mode
+		if aperture_cache is None:
+			self._aperture_cache = ApertureCache()
+		else:
+			self._aperture_cache = aperture_cache
+		self._profiler = profiler
+		self._aperture_def = None
 		self._aperture = None
+		self._drill_diameter = None
 		self._drill = None
+		# Flashes and drill hits are collected per aperture and drill
+		# diameter and drawn in bulk when the polarity changes or at the end
+		self._flashes = { }
+		self._drills = { }
+
+	@property
+	def _vector_mode(self):
+		return self._render_mode == "vector"
+
+	def _get_aperture(self):
+		# Aperture bitmaps are only needed for blitting, render them lazily.
+		if self._aperture is None:
+			self._aperture = self._aperture_cache.get(self._aperture_def, dpi = self._cctx.dpi, color = self._src_color)
+		if self._profiler is not None:
+			self._profiler.count("blits")
+		return self._aperture
+
+	def _flush(self):
+		"""Draws all collected flashes and drill hits. All of them are drawn in
+		the same color and polarity, so the order in which they are drawn does
+		not matter."""
+		for (aperture_def, points) in self._flashes.items():
+			if not ApertureRenderer.draw_flashes(self._cctx, aperture_def, points, color = self._src_color, unit = "in"):
+				aperture = self._aperture_cache.get(aperture_def, dpi = self._cctx.dpi, color = self._src_color)
+				for point in points:
+					aperture.blit(self._cctx, point, unit = "in")
+				if self._profiler is not None:
+					self._profiler.count("blits", len(points))
+		self._flashes = { }
+		for (diameter, points) in self._drills.items():
+			self._cctx.fill_circles(points, diameter / 2, color = self._src_color, unit = "in")
+		self._drills = { }
 
 	def drawmode_clear(self):
+		self._flush()
 		self._cctx.set_mode_erase()
 
 	def drawmode_dark(self):
+		self._flush()
 		self._cctx.set_mode_draw()
 
 	def end_path(self):
-		self._cctx.cctx.fill()
-		self._cctx.draw_path(self._path, color = self._src_color, unit = "in")
+		self._cctx.fill_path(self._path, color = self._src_color, unit = "in")
 		self._path = [ ]
 
 	def close_contour(self):
 		pass
 
 	def select_aperture(self, aperture_def):
-		self._aperture = ApertureRenderer.from_definition(aperture_def, dpi = self._cctx.dpi, color = self._src_color)
+		self._aperture_def = aperture_def
+		self._aperture = None
 
 	def circle(self, center_pt, radius):
-		if self._aperture is not None:
-			self._aperture.blit_circle(self._cctx, center_pt, radius, unit = "in")
+		if self._aperture_def is None:
+			return
+		if self._vector_mode and ApertureRenderer.draw_circle(self._cctx, self._aperture_def, center_pt, radius, color = self._src_color, unit = "in"):
+			return
+		self._get_aperture().blit_circle(self._cctx, center_pt, radius, unit = "in")
 
 	def arc_ccw(self, start_pt, end_pt, center_pt):
-		if self._aperture is not None:
-			self._aperture.blit_arc_ccw(self._cctx, start_pt, end_pt, center_pt, unit = "in")
+		if self._aperture_def is None:
+			return
+		if self._vector_mode and ApertureRenderer.draw_arc(self._cctx, self._aperture_def, start_pt, end_pt, center_pt, clockwise = False, color = self._src_color, unit = "in"):
+			return
+		self._get_aperture().blit_arc_ccw(self._cctx, start_pt, end_pt, center_pt, unit = "in")
 
 	def arc_cw(self, start_pt, end_pt, center_pt):
-		if self._aperture is not None:
-			self._aperture.blit_arc_cw(self._cctx, start_pt, end_pt, center_pt, unit = "in")
+		if self._aperture_def is None:
+			return
+		if self._vector_mode and ApertureRenderer.draw_arc(self._cctx, self._aperture_def, start_pt, end_pt, center_pt, clockwise = True, color = self._src_color, unit = "in"):
+			return
+		self._get_aperture().blit_arc_cw(self._cctx, start_pt, end_pt, center_pt, unit = "in")
 
 	def line(self, start_pt, end_pt):
-		if self._aperture is not None:
-			self._aperture.blit_line(self._cctx, start_pt, end_pt, unit = "in")
+		if self._aperture_def is None:
+			return
+		if self._vector_mode and ApertureRenderer.draw_line(self._cctx, self._aperture_def, start_pt, end_pt, color = self._src_color, unit = "in"):
+			return
+		self._get_aperture().blit_line(self._cctx, start_pt, end_pt, unit = "in")
 
 	def flash_at(self, point):
-		self.line(point, point)
+		if self._aperture_def is None:
+			return
+		if self._vector_mode:
+			self._flashes.setdefault(self._aperture_def, [ ]).append(point)
+		else:
+			self._get_aperture().blit(self._cctx, point, unit = "in")
 
 	def drill(self, point):
-		self._drill.blit(self._cctx, point, unit = "in")
+		if self._vector_mode:
+			self._drills.setdefault(self._drill_diameter, [ ]).append(point)
+		else:
+			if self._profiler is not None:
+				self._profiler.count("blits")
+			self._drill.blit(self._cctx, point, unit = "in")
 
 	def switch_drill_tool(self, diameter):
-		self._drill = ApertureRenderer.from_raw_definition(aperture_definition_template = "C", aperture_definition_params = (diameter, ), dpi = self._cctx.dpi, color = self._src_color)
+		self._drill_diameter = diameter
+		if not self._vector_mode:
+			self._drill = self._aperture_cache.get_raw(aperture_definition_template = "C", aperture_definition_params = (diameter, ), dpi = self._cctx.dpi, color = self._src_color)
+
+	def _sub_callback(self, cairo_context):
+		return CairoCallback(cairo_context, src_color = self._src_color, render_mode = self._render_mode, aperture_cache = self._aperture_cache, profiler = self._profiler)
+
+	def step_repeat(self, block, offsets):
+		"""Rasterizes the block once and stamps it at every offset. Only the
+		part of the block that some copy places within the surface is
+		rasterized. Blocks that use clear polarity need to clear what lies
+		underneath them and are therefore replayed at every offset instead."""
+		extents = block.extents
+		if extents is None:
+			return
+		self._flush()
+		dpi = self._cctx.dpi
+		if block.uses_clear:
+			cctx = self._cctx.cctx
+			(matrix, operator) = (cctx.get_matrix(), cctx.get_operator())
+			for offset in offsets:
+				# Every copy starts out with the polarity the block started with
+				cctx.set_matrix(matrix)
+				cctx.set_operator(operator)
+				cctx.translate(offset.x * dpi, offset.y * dpi)
+				block.replay(self._sub_callback(self._cctx))
+			cctx.set_matrix(matrix)
+			cctx.set_operator(operator)
+		else:
+			block_window = (extents * dpi).pixel_aligned()
+			target = BoundingBox(self._cctx.offset, self._cctx.offset + self._cctx.dimensions)
+			(window, shifts) = (None, [ ])
+			for offset in offsets:
+				# Stamps are placed on whole pixels so they are not resampled
+				shift = Vector2d(round(block_window.min_pt.x + offset.x * dpi) - block_window.min_pt.x, round(block_window.min_pt.y + offset.y * dpi) - block_window.min_pt.y)
+				visible = block_window.intersection(BoundingBox(target.min_pt - shift, target.max_pt - shift))
+				if visible is not None:
+					window = visible.union(window)
+					shifts.append(shift)
+			if window is None:
+				return
+			window = window.pixel_aligned()
+			block_cctx = CairoContext(dimensions = window.dimensions, offset = window.min_pt, dpi = dpi, mask = self._cctx.is_mask)
+			block.replay(self._sub_callback(block_cctx), window = window * (1 / dpi))
+			self._cctx.stamp(block_cctx, [ window.min_pt + shift for shift in shifts ])
+			if self._profiler is not None:
+				self._profiler.count("blits", len(shifts))
+
+	def finish(self):
+		self._flush()
 
 class SizeDeterminationCallback(BaseCallback):
+	"""Determines the exact bounds of everything drawn, see Extents. Display
+	lists already know their extents, this is for interpreting files
+	directly."""
 	def __init__(self):
 		BaseCallback.__init__(self)
-		self._minx = None
-		self._miny = None
-		self._maxx = None
-		self._maxy = None
-		self._aperture = None
-
-	def _add_point(self, point):
-		if self._aperture is not None:
-			minpt = point - self._aperture
-			maxpt = point + self._aperture
-		else:
-			minpt = point
-			maxpt = point
-		self._minx = minpt.x if (self._minx is None) else min(self._minx, minpt.x)
-		self._miny = minpt.y if (self._miny is None) else min(self._miny, minpt.y)
-		self._maxx = maxpt.x if (self._maxx is None) else max(self._maxx, maxpt.x)
-		self._maxy = maxpt.y if (self._maxy is None) else max(self._maxy, maxpt.y)
+		self._extents = Extents()
+		self._margin = None
 
 	@property
 	def min_pt(self):
-		if (self._minx is not None) and (self._miny is not None):
-			return Vector2d(self._minx, self._miny)
-		else:
-			return None
+		return self._extents.min_pt
 
 	@property
 	def max_pt(self):
-		if (self._maxx is not None) and (self._maxy is not None):
-			return Vector2d(self._maxx, self._maxy)
-		else:
-			return None
+		return self._extents.max_pt
+
+	@property
+	def bounding_box(self):
+		return self._extents.bounding_box
+
+	def region_move(self, point):
+		self._extents.add_point(point)
+
+	def region_line(self, point):
+		self._extents.add_point(point)
+
+	def region_arc(self, start_pt, end_pt, center_pt, clockwise):
+		self._extents.add_region_arc(start_pt, end_pt, center_pt, clockwise)
+
+	def circle(self, center_pt, radius):
+		self._extents.add_circle(center_pt, radius, self._margin)
+
+	def arc_ccw(self, start_pt, end_pt, center_pt):
+		self._extents.add_arc(start_pt, end_pt, center_pt, False, self._margin)
+
+	def arc_cw(self, start_pt, end_pt, center_pt):
+		self._extents.add_arc(start_pt, end_pt, center_pt, True, self._margin)
 
 	def line(self, start_pt, end_pt):
-		self._add_point(start_pt)
-		self._add_point(end_pt)
+		self._extents.add_line(start_pt, end_pt, self._margin)
 
 	def flash_at(self, point):
-		self._add_point(point)
+		self._extents.add_point(point, self._margin)
 
 	def select_aperture(self, aperture_def):
-		self._aperture = ApertureRenderer.physical_extents(aperture_def) / 2
+		self._margin = aperture_def.extents
 
 	def drill(self, point):
-		self._add_point(point)
+		self._extents.add_point(point, self._margin)
 
 	def switch_drill_tool(self, diameter):
-		self._aperture = Vector2d(diameter, diameter) / 2
+		self._margin = Vector2d(diameter / 2, diameter / 2)
 
-	def end_path(self):
-		last_aperture = self._aperture
-		self._aperture = None
-		gip = GeoInterpolation(callback = self._add_point)
-		gip.path(self._path)
-		self._aperture = last_aperture
-		self._path = [ ]
+	def step_repeat(self, block, offsets):
+		self._extents.add_step_repeat(block.extents, offsets)
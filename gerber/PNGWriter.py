@@ -0,0 +1,216 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import zlib
+import struct
+try:
+	import numpy
+except ImportError:
+	numpy = None
+from .CairoContext import CairoContext
+
+class PNGWriter():
+	"""Writes a PNG image strip by strip. Every strip is a CairoContext of the
+	full image width whose rows are encoded and compressed as soon as it is
+	written, so neither the whole image nor its encoded form need to be held
+	in memory. Supported formats are 8 and 16 bit RGBA and an indexed format
+	with a 6x6x6 color cube plus one fully transparent palette entry.
+
+	Strips are encoded in chunks of a fixed number of rows, so the temporary
+	arrays needed for conversion stay small even if a strip is the whole
+	image."""
+	FORMATS = ("rgba8", "rgba16", "indexed")
+	_IDAT_SIZE = 256 * 1024
+	_CHUNK_ROWS = 256
+
+	def __init__(self, f, width, height, png_format = "rgba8", compression = 6):
+		if png_format not in self.FORMATS:
+			raise ValueError("Unknown PNG format '%s', supported are %s." % (png_format, ", ".join(self.FORMATS)))
+		self._f = f
+		self._owns_file = False
+		self._width = width
+		self._height = height
+		self._format = png_format
+		self._rows_written = 0
+		self._compressor = zlib.compressobj(compression)
+		self._pending = [ ]
+		self._pending_size = 0
+		self._write_header()
+
+	@classmethod
+	def open(cls, filename, width, height, png_format = "rgba8", compression = 6):
+		"""Opens the given filename for writing, '-' writes to the process's
+		stdout even if sys.stdout has been redirected. Binary streams are
+		written to directly and are not closed."""
+		if not isinstance(filename, str):
+			return cls(filename, width, height, png_format = png_format, compression = compression)
+		elif filename == "-":
+			return cls(sys.__stdout__.buffer, width, height, png_format = png_format, compression = compression)
+		else:
+			writer = cls(open(filename, "wb"), width, height, png_format = png_format, compression = compression)
+			writer._owns_file = True
+			return writer
+
+	@property
+	def rows_written(self):
+		return self._rows_written
+
+	def _write_chunk(self, chunk_type, data):
+		self._f.write(struct.pack(">L", len(data)))
+		self._f.write(chunk_type)
+		self._f.write(data)
+		self._f.write(struct.pack(">L", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+	def _write_header(self):
+		self._f.write(b"\x89PNG\r\n\x1a\n")
+		if self._format == "rgba8":
+			(bit_depth, color_type) = (8, 6)
+		elif self._format == "rgba16":
+			(bit_depth, color_type) = (16, 6)
+		else:
+			(bit_depth, color_type) = (8, 3)
+		self._write_chunk(b"IHDR", struct.pack(">LLBBBBB", self._width, self._height, bit_depth, color_type, 0, 0, 0))
+		if self._format == "indexed":
+			# Palette index 0 is fully transparent, 1..216 are the color cube
+			palette = bytearray(3)
+			for r in range(6):
+				for g in range(6):
+					for b in range(6):
+						palette += bytes((r * 51, g * 51, b * 51))
+			self._write_chunk(b"PLTE", bytes(palette))
+			self._write_chunk(b"tRNS", b"\x00")
+
+	def _flush_pending(self):
+		data = b"".join(self._pending)
+		self._pending = [ ]
+		self._pending_size = 0
+		if len(data) > 0:
+			self._write_chunk(b"IDAT", data)
+
+	def _add_compressed(self, data):
+		if len(data) > 0:
+			self._pending.append(data)
+			self._pending_size += len(data)
+			if self._pending_size >= self._IDAT_SIZE:
+				self._flush_pending()
+
+	@staticmethod
+	def _unpremultiply(value, alpha, maxvalue):
+		if alpha == 0:
+			return 0
+		return min(maxvalue, (value * maxvalue + alpha // 2) // alpha)
+
+	def _encode_rows_numpy(self, pixels, is_mask):
+		"""Encodes the rows of a pixel array as returned by
+		CairoContext.pixel_array()."""
+		height = pixels.shape[0]
+		if is_mask:
+			alpha = pixels.astype(numpy.uint32)
+			(b, g, r) = (numpy.zeros_like(alpha), ) * 3
+		else:
+			pixels = pixels[:, : self._width].astype(numpy.uint32)
+			(b, g, r, alpha) = (pixels[:, :, channel] for channel in CairoContext.CHANNELS)
+
+		nonzero = numpy.maximum(alpha, 1)
+		if self._format == "rgba16":
+			(maxvalue, dtype) = (0xffff, ">u2")
+		else:
+			(maxvalue, dtype) = (0xff, numpy.uint8)
+		channels = [ numpy.where(alpha == 0, 0, numpy.minimum(maxvalue, (c * maxvalue + alpha // 2) // nonzero)) for c in (r, g, b) ]
+
+		if self._format == "indexed":
+			(r, g, b) = ((c + 25) // 51 for c in channels)
+			rows = numpy.where(alpha < 0x80, 0, 1 + (r * 36) + (g * 6) + b).astype(numpy.uint8)
+		else:
+			channels.append(alpha * maxvalue // 0xff)
+			rows = numpy.stack(channels, axis = -1).astype(dtype).reshape(height, -1)
+
+		filtered = numpy.zeros((height, 1 + rows.view(numpy.uint8).shape[1]), dtype = numpy.uint8)
+		filtered[:, 1:] = rows.view(numpy.uint8)
+		return filtered.tobytes()
+
+	def _encode_pixel(self, r, g, b, alpha):
+		if self._format == "indexed":
+			if alpha < 0x80:
+				return b"\x00"
+			(r, g, b) = ((self._unpremultiply(c, alpha, 0xff) + 25) // 51 for c in (r, g, b))
+			return bytes((1 + (r * 36) + (g * 6) + b, ))
+		elif self._format == "rgba16":
+			(r, g, b) = (self._unpremultiply(c, alpha, 0xffff) for c in (r, g, b))
+			return struct.pack(">HHHH", r, g, b, alpha * 0x101)
+		else:
+			(r, g, b) = (self._unpremultiply(c, alpha, 0xff) for c in (r, g, b))
+			return bytes((r, g, b, alpha))
+
+	def _encode_rows_python(self, cctx, first_row, end_row):
+		data = cctx.surface.get_data()
+		stride = cctx.surface.get_stride()
+		(blue, green, red, alpha) = CairoContext.CHANNELS
+		encoded = bytearray()
+		for y in range(first_row, end_row):
+			encoded.append(0)
+			row = y * stride
+			for x in range(cctx.width):
+				if cctx.is_mask:
+					encoded += self._encode_pixel(0, 0, 0, data[row + x])
+				else:
+					pixel = row + (4 * x)
+					encoded += self._encode_pixel(data[pixel + red], data[pixel + green], data[pixel + blue], data[pixel + alpha])
+		return bytes(encoded)
+
+	def write_strip(self, cctx):
+		"""Encodes all rows of the given context, topmost row first."""
+		if cctx.width != self._width:
+			raise ValueError("Strip width %d does not match image width %d." % (cctx.width, self._width))
+		if self._rows_written + cctx.height > self._height:
+			raise ValueError("Strip of %d rows exceeds image height %d (%d rows already written)." % (cctx.height, self._height, self._rows_written))
+		if numpy is not None:
+			pixels = cctx.pixel_array()
+		else:
+			cctx.surface.flush()
+		for first_row in range(0, cctx.height, self._CHUNK_ROWS):
+			end_row = min(first_row + self._CHUNK_ROWS, cctx.height)
+			if numpy is not None:
+				encoded = self._encode_rows_numpy(pixels[first_row : end_row], cctx.is_mask)
+			else:
+				encoded = self._encode_rows_python(cctx, first_row, end_row)
+			self._add_compressed(self._compressor.compress(encoded))
+		self._rows_written += cctx.height
+
+	def close(self):
+		if self._rows_written != self._height:
+			raise ValueError("Image height is %d, but %d rows were written." % (self._height, self._rows_written))
+		self._add_compressed(self._compressor.flush())
+		self._flush_pending()
+		self._write_chunk(b"IEND", b"")
+		if self._owns_file:
+			self._f.close()
+		else:
+			self._f.flush()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		if args[0] is None:
+			self.close()
+		elif self._owns_file:
+			self._f.close()
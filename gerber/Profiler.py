@@ -0,0 +1,144 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import json
+import time
+import contextlib
+import collections
+
+class Profiler():
+	"""Records wall and CPU time of nested, named sections and event counters
+	attributed to the innermost active section. A disabled profiler records
+	nothing and costs next to nothing. Not safe to share between threads."""
+	_NULL_SECTION = contextlib.nullcontext()
+
+	def __init__(self, enabled = True):
+		self._enabled = enabled
+		self._stack = ( )
+		self._sections = collections.OrderedDict()
+		self._counters = collections.OrderedDict()
+
+	@property
+	def enabled(self):
+		return self._enabled
+
+	@contextlib.contextmanager
+	def _section(self, name):
+		parent = self._stack
+		self._stack = parent + (name, )
+		t0 = (time.perf_counter(), time.process_time())
+		try:
+			yield
+		finally:
+			entry = self._sections.get(self._stack)
+			if entry is None:
+				entry = [ 0, 0, 0 ]
+				self._sections[self._stack] = entry
+			entry[0] += 1
+			entry[1] += time.perf_counter() - t0[0]
+			entry[2] += time.process_time() - t0[1]
+			self._stack = parent
+
+	def section(self, name):
+		"""Context manager that times the enclosed code as section name,
+		nested within the currently active section."""
+		if not self._enabled:
+			return self._NULL_SECTION
+		return self._section(name)
+
+	def count(self, name, value = 1):
+		if self._enabled and (value != 0):
+			counters = self._counters.get(self._stack)
+			if counters is None:
+				counters = collections.Counter()
+				self._counters[self._stack] = counters
+			counters[name] += value
+
+	def reset(self):
+		self._sections.clear()
+		self._counters.clear()
+
+	def export(self):
+		"""Returns the recorded data in a picklable form for merge()."""
+		return (dict(self._sections), { path: dict(counters) for (path, counters) in self._counters.items() })
+
+	def merge(self, exported, prefix = ( )):
+		"""Adds data exported by another profiler, e.g., in a worker process,
+		with all sections nested below the given prefix path."""
+		if not self._enabled:
+			return
+		(sections, counters) = exported
+		for (path, (calls, wall, cpu)) in sections.items():
+			entry = self._sections.setdefault(prefix + path, [ 0, 0, 0 ])
+			entry[0] += calls
+			entry[1] += wall
+			entry[2] += cpu
+		for (path, path_counters) in counters.items():
+			self._counters.setdefault(prefix + path, collections.Counter()).update(path_counters)
+
+	@property
+	def counters(self):
+		"""Totals of all counters over all sections."""
+		totals = collections.Counter()
+		for counters in self._counters.values():
+			totals.update(counters)
+		return totals
+
+	def _self_times(self):
+		self_times = { path: entry[1] for (path, entry) in self._sections.items() }
+		for (path, entry) in self._sections.items():
+			if path[:-1] in self_times:
+				self_times[path[:-1]] -= entry[1]
+		return self_times
+
+	def to_dict(self):
+		self_times = self._self_times()
+		sections = [ ]
+		for (path, (calls, wall, cpu)) in sorted(self._sections.items()):
+			sections.append({
+				"path":			list(path),
+				"calls":		calls,
+				"wall":			wall,
+				"cpu":			cpu,
+				"self_wall":	max(0, self_times[path]),
+				"counters":		dict(self._counters.get(path, { })),
+			})
+		return {
+			"sections":		sections,
+			"counters":		dict(self.counters),
+		}
+
+	def write_json(self, filename):
+		with open(filename, "w") as f:
+			json.dump(self.to_dict(), f, indent = 4, sort_keys = True)
+			f.write("\n")
+
+	def write_folded(self, filename):
+		"""Writes exclusive wall time in microseconds in the folded stack
+		format understood by flamegraph.pl, speedscope and similar tools."""
+		self_times = self._self_times()
+		with open(filename, "w") as f:
+			for path in sorted(self._sections):
+				microseconds = round(max(0, self_times[path]) * 1e6)
+				if microseconds > 0:
+					print("%s %d" % (";".join(path), microseconds), file = f)
+
+	def __str__(self):
+		return "Profiler<%d sections, %s>" % (len(self._sections), ", ".join("%s=%d" % (name, value) for (name, value) in sorted(self.counters.items())))
@@ -0,0 +1,182 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import zlib
+import hashlib
+import tempfile
+import threading
+from .CairoContext import CairoContext
+
+class RenderCache():
+	"""Persistent, content-addressed cache of rasterized render steps. Keys
+	are hashes over everything that determines a rendering; entries are never
+	invalidated, only evicted least recently used first once the cache
+	directory grows beyond its maximum size. Entries are stored compressed.
+
+	The size of the cache directory is determined by scanning it once and
+	then kept as running total. Other processes sharing the directory are
+	accounted for when the total exceeds the maximum size: the directory is
+	scanned again and entries are evicted until it has shrunk to a fraction
+	of its maximum size, so that this happens rarely."""
+	_SUFFIX = ".layer"
+	_EVICT_TO = 0.75
+
+	def __init__(self, cache_dir, max_size = 512 * 1024 * 1024, compression = 1):
+		self._cache_dir = cache_dir
+		self._max_size = max_size
+		self._compression = compression
+		self._hits = 0
+		self._misses = 0
+		self._size = None
+		self._lock = threading.Lock()
+
+	@classmethod
+	def default_directory(cls):
+		cache_home = os.environ.get("XDG_CACHE_HOME")
+		if cache_home is None:
+			cache_home = os.path.expanduser("~/.cache")
+		return os.path.join(cache_home, "gerberpeek")
+
+	@property
+	def hits(self):
+		return self._hits
+
+	@property
+	def misses(self):
+		return self._misses
+
+	@staticmethod
+	def key(*components):
+		"""Derives a key from JSON serializable components and bytes."""
+		digest = hashlib.sha256()
+		for component in components:
+			if isinstance(component, bytes):
+				data = component
+			else:
+				data = json.dumps(component, sort_keys = True).encode("utf-8")
+			digest.update(len(data).to_bytes(8, byteorder = "little"))
+			digest.update(data)
+		return digest.hexdigest()
+
+	def _filename(self, key):
+		return os.path.join(self._cache_dir, key[:2], key + self._SUFFIX)
+
+	def __contains__(self, key):
+		return os.path.isfile(self._filename(key))
+
+	def get(self, key):
+		"""Returns a tuple (hit, rendering). The rendering of a hit is None if
+		the step was found to have no content."""
+		filename = self._filename(key)
+		try:
+			with open(filename, "rb") as f:
+				header = json.loads(f.readline())
+				data = f.read()
+		except (FileNotFoundError, ValueError):
+			self._misses += 1
+			return (False, None)
+
+		# Mark entry as recently used
+		try:
+			os.utime(filename)
+		except FileNotFoundError:
+			# Evicted concurrently, data has been read already
+			pass
+		self._hits += 1
+		if header is None:
+			return (True, None)
+		if header.pop("encoding", None) == "zlib":
+			data = zlib.decompress(data)
+		header["data"] = data
+		return (True, CairoContext.from_buffer(header))
+
+	def put(self, key, rendering):
+		if rendering is None:
+			(header, data) = (None, b"")
+		else:
+			header = rendering.to_buffer()
+			header["encoding"] = "zlib"
+			data = zlib.compress(header.pop("data"), self._compression)
+
+		filename = self._filename(key)
+		os.makedirs(os.path.dirname(filename), exist_ok = True)
+		(fd, tmpname) = tempfile.mkstemp(dir = os.path.dirname(filename), suffix = ".tmp")
+		with os.fdopen(fd, "wb") as f:
+			f.write(json.dumps(header).encode("utf-8") + b"\n")
+			f.write(data)
+			entry_size = f.tell()
+		try:
+			replaced_size = os.stat(filename).st_size
+		except FileNotFoundError:
+			replaced_size = 0
+		os.replace(tmpname, filename)
+
+		with self._lock:
+			if self._size is None:
+				self._size = self._scan_size()
+			else:
+				self._size += entry_size - replaced_size
+			exceeded = self._size > self._max_size
+		if exceeded:
+			self.evict()
+
+	def _entries(self):
+		for (basedir, subdirs, files) in os.walk(self._cache_dir):
+			for filename in files:
+				if filename.endswith(self._SUFFIX):
+					full_filename = os.path.join(basedir, filename)
+					try:
+						stat = os.stat(full_filename)
+					except FileNotFoundError:
+						# Evicted concurrently
+						continue
+					yield (stat.st_mtime, stat.st_size, full_filename)
+
+	def _scan_size(self):
+		return sum(size for (mtime, size, filename) in self._entries())
+
+	@property
+	def size(self):
+		with self._lock:
+			if self._size is None:
+				self._size = self._scan_size()
+			return self._size
+
+	def evict(self):
+		"""Scans the cache directory and removes least recently used entries
+		until the cache has shrunk well below its maximum size."""
+		with self._lock:
+			entries = sorted(self._entries())
+			total_size = sum(size for (mtime, size, filename) in entries)
+			if total_size > self._max_size:
+				for (mtime, size, filename) in entries:
+					if total_size <= self._max_size * self._EVICT_TO:
+						break
+					try:
+						os.unlink(filename)
+					except FileNotFoundError:
+						pass
+					total_size -= size
+			self._size = total_size
+
+	def __str__(self):
+		return "RenderCache<%s, %d hits, %d misses>" % (self._cache_dir, self.hits, self.misses)
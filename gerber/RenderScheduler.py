@@ -0,0 +1,108 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import copy
+import concurrent.futures
+from .CairoContext import CairoContext
+from .Renderscript import RenderscriptSyntaxError
+
+_worker_renderscript = None
+
+def _initialize_worker(renderscript):
+	global _worker_renderscript
+	# Copying drops process-local state such as open archive handles, which
+	# forked workers would otherwise share with the parent.
+	_worker_renderscript = copy.copy(renderscript)
+
+def _render_in_worker(name):
+	rendering = _worker_renderscript.render(name)
+	profile = _worker_renderscript.profiler.export()
+	_worker_renderscript.profiler.reset()
+	if rendering is None:
+		return (None, profile)
+	return (rendering.to_buffer(), profile)
+
+class RenderScheduler():
+	"""Builds the dependency graph of render steps from the render script and
+	renders all independent leaf steps (i.e., the render-gerber and
+	render-drill steps) in a process pool. The raster buffers are shipped
+	back to the parent process, which then only needs to compose them."""
+
+	def __init__(self, renderscript, jobs):
+		self._renderscript = renderscript
+		self._jobs = jobs
+
+	def _dependencies(self, name):
+		step = self._renderscript.get_step(name)
+		if step["action"] == "compose":
+			return [ source["name"] for source in step["sources"] ]
+		else:
+			return [ ]
+
+	def leaf_steps(self, names):
+		"""Returns the leaf render steps the given steps depend on, in
+		depth-first order. Steps available from the render cache are not
+		descended into. Raises RenderscriptSyntaxError for references to
+		unknown steps or cyclic compositions."""
+		leaves = [ ]
+		visited = set()
+		in_progress = set()
+
+		def visit(name, parent):
+			if name in visited:
+				return
+			if name in in_progress:
+				raise RenderscriptSyntaxError("Render step '%s' depends on itself." % (name))
+			if not self._renderscript.has_step(name):
+				raise RenderscriptSyntaxError("Render step '%s' references unknown render step '%s'." % (parent, name))
+			if self._renderscript.is_cached(name):
+				visited.add(name)
+				return
+			dependencies = self._dependencies(name)
+			if len(dependencies) == 0:
+				leaves.append(name)
+			else:
+				in_progress.add(name)
+				for dependency in dependencies:
+					visit(dependency, name)
+				in_progress.remove(name)
+			visited.add(name)
+
+		for name in names:
+			visit(name, None)
+		return leaves
+
+	def run(self, names):
+		leaves = [ name for name in self.leaf_steps(names) if not self._renderscript.is_rendered(name) ]
+		if (self._jobs <= 1) or (len(leaves) <= 1):
+			for name in leaves:
+				self._renderscript.render(name)
+			return
+
+		with concurrent.futures.ProcessPoolExecutor(max_workers = self._jobs, initializer = _initialize_worker, initargs = (self._renderscript, )) as executor:
+			futures = { executor.submit(_render_in_worker, name): name for name in leaves }
+			for name in leaves:
+				# Parsed by the workers
+				self._renderscript.release_source_data(name)
+			for future in concurrent.futures.as_completed(futures):
+				(buffer, profile) = future.result()
+				self._renderscript.profiler.merge(profile)
+				rendering = None if (buffer is None) else CairoContext.from_buffer(buffer)
+				self._renderscript.set_rendering(futures[future], rendering)
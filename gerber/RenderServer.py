@@ -0,0 +1,401 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import io
+import os
+import sys
+import json
+import time
+import zipfile
+import queue
+import argparse
+import threading
+import traceback
+import multiprocessing
+import socketserver
+import http.server
+import urllib.parse
+from .PNGWriter import PNGWriter
+from .Renderscript import Renderscript, RenderscriptTimeoutError
+
+class RenderServerError(Exception):
+	def __init__(self, status, message):
+		super().__init__(message)
+		self.status = status
+
+class RenderServerMetrics():
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._started = time.time()
+		self._counters = {
+			"requests":		0,
+			"succeeded":	0,
+			"failed":		0,
+			"rejected":		0,
+			"timeouts":		0,
+			"too_large":	0,
+		}
+		self._active = 0
+		self._render_time = 0
+		self._max_render_time = 0
+
+	def count(self, name):
+		with self._lock:
+			self._counters[name] += 1
+
+	def job_started(self):
+		with self._lock:
+			self._active += 1
+
+	def job_finished(self, elapsed):
+		with self._lock:
+			self._active -= 1
+			self._render_time += elapsed
+			self._max_render_time = max(self._max_render_time, elapsed)
+
+	def to_dict(self):
+		with self._lock:
+			result = dict(self._counters)
+			finished = self._counters["succeeded"] + self._counters["failed"] + self._counters["timeouts"]
+			result.update({
+				"uptime":			time.time() - self._started,
+				"active":			self._active,
+				"render_time":		self._render_time,
+				"avg_render_time":	(self._render_time / finished) if (finished > 0) else None,
+				"max_render_time":	self._max_render_time,
+			})
+			return result
+
+class RenderRequestHandler(http.server.BaseHTTPRequestHandler):
+	"""Handles the HTTP API of the render server:
+
+	POST /render?deliverable=name[&deliverable=name...][&resolution=dpi][&format=png_format][&viewport=x1,y1,x2,y2]
+		Request body is a ZIP file containing the board's Gerber files, bodies
+		larger than the server's upload limit are rejected with 413. With
+		a single deliverable, the response is the PNG image, with multiple
+		ones a ZIP file with one PNG per deliverable. A viewport renders only
+		that window of the board, see Renderscript.parse_viewport().
+	GET /health
+		Returns status 200 as long as the server accepts jobs.
+	GET /metrics
+		Returns job counters, timing and cache statistics as JSON.
+	"""
+	protocol_version = "HTTP/1.1"
+
+	def address_string(self):
+		if isinstance(self.client_address, tuple):
+			return self.client_address[0]
+		else:
+			return "unix"
+
+	def log_message(self, fmt, *args):
+		if self.server.render_server.verbose >= 1:
+			super().log_message(fmt, *args)
+
+	def _send(self, status, content_type, data):
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def _send_json(self, status, data):
+		self._send(status, "application/json", json.dumps(data, sort_keys = True).encode("utf-8") + b"\n")
+
+	def do_GET(self):
+		path = urllib.parse.urlsplit(self.path).path
+		if path == "/health":
+			self._send_json(200, { "status": "ok" })
+		elif path == "/metrics":
+			self._send_json(200, self.server.render_server.metrics())
+		else:
+			self._send_json(404, { "error": "Not found: %s" % (path) })
+
+	def _upload_length(self):
+		"""Returns the length of the request body or None, after sending an
+		error response, if the body is not acceptable. The body is then not
+		read, so the connection cannot be reused."""
+		try:
+			length = int(self.headers.get("Content-Length", 0))
+		except ValueError:
+			length = -1
+		if length < 0:
+			self.close_connection = True
+			self._send_json(400, { "error": "Invalid Content-Length." })
+			return None
+		max_upload = self.server.render_server.max_upload
+		if length > max_upload:
+			self.close_connection = True
+			self.server.render_server.count_too_large()
+			self._send_json(413, { "error": "Upload of %d bytes exceeds limit of %d bytes." % (length, max_upload) })
+			return None
+		return length
+
+	def handle_expect_100(self):
+		# Reject large uploads before the client starts sending them
+		if self._upload_length() is None:
+			return False
+		return super().handle_expect_100()
+
+	def do_POST(self):
+		url = urllib.parse.urlsplit(self.path)
+		if url.path != "/render":
+			self._send_json(404, { "error": "Not found: %s" % (url.path) })
+			return
+
+		length = self._upload_length()
+		if length is None:
+			return
+		data = self.rfile.read(length)
+		try:
+			(content_type, response) = self.server.render_server.handle_render(urllib.parse.parse_qs(url.query), data)
+			self._send(200, content_type, response)
+		except RenderServerError as e:
+			self._send_json(e.status, { "error": str(e) })
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+	daemon_threads = True
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+	daemon_threads = True
+
+def _cache_statistics(renderscript):
+	statistics = { }
+	for (name, cache) in (("aperture_cache", renderscript.aperture_cache), ("display_list_cache", renderscript.display_list_cache), ("render_cache", renderscript.render_cache)):
+		if cache is not None:
+			statistics[name] = { "hits": cache.hits, "misses": cache.misses }
+	return statistics
+
+def _render_job(template, args, deliverables, png_format, data, job_timeout):
+	"""Renders one job and returns a tuple of content type and response data.
+	Raises RenderServerError on failure."""
+	board = template.clone(args = args)
+	try:
+		board.set_timeout(job_timeout)
+		try:
+			board.add_source_archive(io.BytesIO(data))
+		except zipfile.BadZipFile as e:
+			raise RenderServerError(400, "Upload is not a ZIP file: %s" % (str(e)))
+
+		results = { }
+		for name in deliverables:
+			f = io.BytesIO()
+			if not board.write_deliverable(name, f, png_format = png_format, compression = args.png_compression, tile_size = args.tile_size, common_canvas = args.common_canvas, viewport = args.viewport):
+				raise RenderServerError(422, "Deliverable '%s' has no content." % (name))
+			results[name] = f.getvalue()
+	except RenderscriptTimeoutError:
+		raise RenderServerError(504, "Job exceeded timeout of %g seconds." % (job_timeout))
+	except RenderServerError:
+		raise
+	except Exception as e:
+		if args.verbose >= 1:
+			traceback.print_exc()
+		raise RenderServerError(500, "%s: %s" % (e.__class__.__name__, str(e)))
+	finally:
+		board.close()
+
+	if len(results) == 1:
+		return ("image/png", results[deliverables[0]])
+	f = io.BytesIO()
+	with zipfile.ZipFile(f, "w") as zfile:
+		for (name, png_data) in results.items():
+			zfile.writestr(name + ".png", png_data)
+	return ("application/zip", f.getvalue())
+
+def _serve_jobs(renderscript, conn):
+	"""Main loop of a render worker process. All jobs are rendered on clones
+	of the same template, so the worker's caches stay warm between jobs."""
+	template = renderscript.clone()
+	while True:
+		try:
+			job = conn.recv()
+		except EOFError:
+			break
+		try:
+			result = ("ok", _render_job(template, *job))
+		except RenderServerError as e:
+			result = ("error", (e.status, str(e)))
+		conn.send((result, _cache_statistics(template)))
+
+class _RenderWorker():
+	"""A render worker process that is owned by one request at a time. It
+	can be terminated at any point, e.g., when it is stuck rendering."""
+
+	def __init__(self, renderscript):
+		(self._conn, child_conn) = multiprocessing.Pipe()
+		self._process = multiprocessing.Process(target = _serve_jobs, args = (renderscript, child_conn), daemon = True)
+		self._process.start()
+		child_conn.close()
+		self.cache_statistics = { }
+
+	def render(self, job, timeout):
+		"""Returns the worker's result or None if it did not finish within
+		the timeout. Raises EOFError if the worker process died."""
+		self._conn.send(job)
+		if not self._conn.poll(timeout):
+			return None
+		(result, self.cache_statistics) = self._conn.recv()
+		return result
+
+	def terminate(self):
+		self._process.terminate()
+		self._process.join()
+		self._conn.close()
+
+class RenderServer():
+	"""Long-running render service. The render script is parsed once and
+	every job renders an uploaded ZIP file on a Renderscript cloned from the
+	template. Jobs run in a pool of max_concurrent worker processes that live
+	as long as the server, so each keeps its aperture and display list caches
+	warm. These caches and the render cache are keyed by the SHA-256 of the
+	uploaded files, so a job is only ever served renderings of identical
+	files. Jobs that do not get a worker within the job timeout are rejected.
+	A job that takes longer than the timeout is aborted; if it does not stop
+	by itself shortly after, its worker is terminated and replaced."""
+	_KILL_GRACE = 1
+
+	def __init__(self, renderscript, args, max_concurrent = 1, job_timeout = 60, max_upload = 64 * 1024 * 1024):
+		self._renderscript = renderscript
+		self._args = args
+		self._job_timeout = job_timeout
+		self._max_upload = max_upload
+		self._metrics = RenderServerMetrics()
+		self._workers = [ ]
+		self._idle_workers = queue.Queue()
+		for i in range(max_concurrent):
+			# Workers are only started when first needed
+			self._idle_workers.put(None)
+
+	@property
+	def verbose(self):
+		return self._args.verbose
+
+	@property
+	def max_upload(self):
+		return self._max_upload
+
+	def count_too_large(self):
+		self._metrics.count("too_large")
+
+	def metrics(self):
+		metrics = self._metrics.to_dict()
+		for worker in list(self._workers):
+			for (name, statistics) in worker.cache_statistics.items():
+				total = metrics.setdefault(name, { "hits": 0, "misses": 0 })
+				total["hits"] += statistics["hits"]
+				total["misses"] += statistics["misses"]
+		return metrics
+
+	def _job_args(self, query):
+		args = argparse.Namespace(**vars(self._args))
+		if "resolution" in query:
+			try:
+				args.resolution = float(query["resolution"][0])
+			except ValueError:
+				raise RenderServerError(400, "Invalid resolution: %s" % (query["resolution"][0]))
+			if not (0 < args.resolution <= 10000):
+				raise RenderServerError(400, "Resolution out of range: %s" % (query["resolution"][0]))
+		if "viewport" in query:
+			try:
+				args.viewport = Renderscript.parse_viewport(query["viewport"][0])
+			except ValueError:
+				raise RenderServerError(400, "Invalid viewport: %s" % (query["viewport"][0]))
+		return args
+
+	def _replace_worker(self, worker):
+		worker.terminate()
+		self._workers.remove(worker)
+		return None
+
+	def handle_render(self, query, data):
+		"""Renders the deliverables named in the query from the ZIP file data
+		and returns a tuple of content type and response data. Raises
+		RenderServerError with a HTTP status code on failure."""
+		self._metrics.count("requests")
+		deliverables = query.get("deliverable", [ ])
+		if len(deliverables) == 0:
+			raise RenderServerError(400, "No deliverable requested.")
+		unknown = set(deliverables) - set(self._renderscript.deliverable_names)
+		if len(unknown) > 0:
+			raise RenderServerError(400, "Unknown deliverable(s): %s" % (", ".join(sorted(unknown))))
+		png_format = query.get("format", [ self._args.png_format ])[0]
+		if png_format not in PNGWriter.FORMATS:
+			raise RenderServerError(400, "Unknown PNG format: %s" % (png_format))
+		args = self._job_args(query)
+
+		try:
+			worker = self._idle_workers.get(timeout = self._job_timeout)
+		except queue.Empty:
+			self._metrics.count("rejected")
+			raise RenderServerError(503, "Server busy, job was not started within %g seconds." % (self._job_timeout))
+		t0 = time.monotonic()
+		self._metrics.job_started()
+		try:
+			if worker is None:
+				worker = _RenderWorker(self._renderscript)
+				self._workers.append(worker)
+			try:
+				result = worker.render((args, deliverables, png_format, data, self._job_timeout), self._job_timeout + self._KILL_GRACE)
+			except (EOFError, OSError):
+				worker = self._replace_worker(worker)
+				raise RenderServerError(500, "Render worker died.")
+			if result is None:
+				worker = self._replace_worker(worker)
+				raise RenderServerError(504, "Job exceeded timeout of %g seconds, worker was terminated." % (self._job_timeout))
+
+			(status, value) = result
+			if status == "ok":
+				self._metrics.count("succeeded")
+				return value
+			(code, message) = value
+			raise RenderServerError(code, message)
+		except RenderServerError as e:
+			self._metrics.count("timeouts" if (e.status == 504) else "failed")
+			raise
+		finally:
+			self._metrics.job_finished(time.monotonic() - t0)
+			self._idle_workers.put(worker)
+
+	def shutdown(self):
+		for worker in list(self._workers):
+			self._replace_worker(worker)
+
+	def _create_server(self, address):
+		if address.startswith("unix:"):
+			path = address[5:]
+			if os.path.exists(path):
+				os.unlink(path)
+			server = _UnixHTTPServer(path, RenderRequestHandler)
+		else:
+			(host, port) = address.rsplit(":", maxsplit = 1)
+			server = _HTTPServer((host, int(port)), RenderRequestHandler)
+		server.render_server = self
+		return server
+
+	def serve_forever(self, address):
+		"""Listens on 'unix:/path/to/socket' or 'host:port'."""
+		with self._create_server(address) as server:
+			print("Render server listening on %s" % (address), file = sys.stderr)
+			try:
+				server.serve_forever()
+			except KeyboardInterrupt:
+				pass
+			finally:
+				self.shutdown()
@@ -22,17 +22,52 @@ import re
 import json
 import sys
 import collections
+import os
+import copy
+import time
 import zipfile
-import tempfile
-from gerber import Vector2d, CairoContext, CairoCallback, Interpreter, DrillInterpreter, SizeDeterminationCallback
+import hashlib
+from gerber import VERSION, Vector2d, BoundingBox, CairoContext, CairoCallback, Interpreter, DrillInterpreter, ApertureCache, RenderCache, PNGWriter, Profiler
 
 class RenderscriptSyntaxError(Exception): pass
 class RenderscriptRenderError(Exception): pass
+class RenderscriptTimeoutError(RenderscriptRenderError): pass
 
 class Renderscript():
 	_COLOR_REGEX = re.compile("#?(?P<r>[0-9a-fA-F]{2})(?P<g>[0-9a-fA-F]{2})(?P<b>[0-9a-fA-F]{2})")
-	def __init__(self, args):
+	_INTERPRETERS = {
+		"render-gerber":	Interpreter,
+		"render-drill":		DrillInterpreter,
+	}
+	_PRIMITIVE_COUNTERS = {
+		"flash_at":		"flashes",
+		"line":			"lines",
+		"arc_cw":		"arcs",
+		"arc_ccw":		"arcs",
+		"circle":		"arcs",
+		"end_path":		"regions",
+		"drill":		"drills",
+		"step_repeat":	"step_repeats",
+	}
+	_POSTPROCESS_STEPS = {
+		# Postprocessing steps operate on the whole surface and should work
+		# on CairoContext.pixel_array() where NumPy is available.
+		"alpha-polarize":	lambda cctx: cctx.alpha_polarize(30),
+	}
+
+	def __init__(self, args, aperture_cache = None, render_cache = None, display_list_cache = None, profiler = None):
 		self._args = args
+		if aperture_cache is None:
+			self._aperture_cache = ApertureCache()
+		else:
+			self._aperture_cache = aperture_cache
+		self._render_cache = render_cache
+		self._display_list_cache = display_list_cache
+		if profiler is None:
+			self._profiler = Profiler(enabled = False)
+		else:
+			self._profiler = profiler
+		self._deadline = None
 		self._script = {
 			"definitions": { },
 			"steps": { },
@@ -40,7 +75,16 @@ class Renderscript():
 		self._deliverable_names = None
 		self._sources = [ ]
 		self._source_archives = collections.OrderedDict()
+		self._open_archives = { }
 		self._deliverables = { }
+		self._display_lists = { }
+		self._spatial_index = False
+		self._leaf_sources = { }
+		self._leaf_display_lists = { }
+		self._extents = { }
+		self._source_digests = { }
+		self._source_data = { }
+		self._cache_keys = { }
 
 	def add_script(self, script_filename):
 		with open(script_filename) as f:
@@ -57,6 +101,8 @@ class Renderscript():
 			self._script["definitions"].update(new_script["definitions"])
 		if "steps" in new_script:
 			self._script["steps"].update(new_script["steps"])
+		if "board_outline" in new_script:
+			self._script["board_outline"] = new_script["board_outline"]
 
 	@staticmethod
 	def _check(filename, script):
@@ -68,6 +114,37 @@ class Renderscript():
 			if step["action"] not in [ "render-gerber", "render-drill", "compose" ]:
 				raise RenderscriptSyntaxError("%s: Render step action '%s' unsupported." % (step["action"], filename))
 
+	def __getstate__(self):
+		# Renderings and caches are specific to one process and not transferred
+		# when a Renderscript is sent to render workers.
+		state = dict(self.__dict__)
+		state["_deliverables"] = { }
+		state["_display_lists"] = { }
+		state["_leaf_display_lists"] = { }
+		state["_extents"] = { }
+		state["_aperture_cache"] = ApertureCache()
+		state["_display_list_cache"] = None
+		state["_profiler"] = Profiler(enabled = self._profiler.enabled)
+		state["_open_archives"] = { }
+		state["_source_data"] = { }
+		return state
+
+	@property
+	def aperture_cache(self):
+		return self._aperture_cache
+
+	@property
+	def render_cache(self):
+		return self._render_cache
+
+	@property
+	def display_list_cache(self):
+		return self._display_list_cache
+
+	@property
+	def profiler(self):
+		return self._profiler
+
 	@property
 	def deliverable_names(self):
 		if self._deliverable_names is None:
@@ -77,21 +154,76 @@ class Renderscript():
 					self._deliverable_names.add(name)
 		return iter(self._deliverable_names)
 
+	def has_step(self, name):
+		return name in self._script["steps"]
+
+	def get_step(self, name):
+		return self._script["steps"][name]
+
+	def clone(self, args = None, profiler = None):
+		"""Returns a Renderscript with the same render script and settings
+		(unless other args are given), sharing all caches, but without any
+		sources or renderings. Used to render many boards without parsing the
+		render scripts again."""
+		if args is None:
+			args = self._args
+		clone = Renderscript(args, aperture_cache = self._aperture_cache, render_cache = self._render_cache, display_list_cache = self._display_list_cache, profiler = profiler)
+		clone._script = copy.deepcopy(self._script)
+		return clone
+
+	def set_timeout(self, timeout):
+		"""Limits the time spent rendering, starting now. The timeout is
+		checked before every render step and tile, a render that exceeds it
+		raises RenderscriptTimeoutError."""
+		self._deadline = None if (timeout is None) else (time.monotonic() + timeout)
+
+	def _check_deadline(self):
+		if (self._deadline is not None) and (time.monotonic() > self._deadline):
+			raise RenderscriptTimeoutError("Render timeout exceeded.")
+
 	def add_definition(self, deffile):
 		with open(deffile) as f:
 			definition = json.load(f)
 		print(definition)
 
-	def _list_zip_archive(self, archive_filename):
-		with zipfile.ZipFile(archive_filename) as zfile:
-			for info in zfile.infolist():
-				yield info.filename
+	def _open_archive(self, archive):
+		"""Archives stay open for the whole session so that members can be
+		read without opening the archive again for every render step."""
+		zfile = self._open_archives.get(archive)
+		if zfile is None:
+			zfile = zipfile.ZipFile(archive)
+			self._open_archives[archive] = zfile
+		return zfile
+
+	def close(self):
+		for zfile in self._open_archives.values():
+			zfile.close()
+		self._open_archives = { }
 
 	def add_source(self, sourcefile):
 		self._sources.append(sourcefile)
 
 	def add_source_archive(self, source_archive):
-		self._source_archives[source_archive] = list(self._list_zip_archive(source_archive))
+		"""The archive is either a filename or a binary stream."""
+		self._source_archives[source_archive] = [ info.filename for info in self._open_archive(source_archive).infolist() ]
+
+	def add_infile(self, source_file, recursive = False):
+		"""Adds a Gerber or drill file, a ZIP archive or, if recursive is
+		requested, all files in a directory."""
+		(base, ext) = os.path.splitext(source_file)
+		if os.path.isfile(source_file):
+			if ext.lower() != ".zip":
+				self.add_source(source_file)
+			else:
+				self.add_source_archive(source_file)
+		else:
+			if recursive:
+				for (basedir, subdirs, files) in os.walk(source_file):
+					for filename in files:
+						full_filename = basedir + "/" + filename
+						self.add_source(full_filename)
+			else:
+				print("%s: Ignoring directory, no recursive action requested." % (source_file), file = sys.stderr)
 
 	def _find_file(self, regex_str, regex_opts = None):
 		if regex_opts is None:
@@ -133,59 +265,111 @@ class Renderscript():
 
 	def _apply_postprocess_steps(self, cctx, postproc_steps):
 		for postproc_step in postproc_steps:
-			if postproc_step == "alpha-polarize":
-				cctx.alpha_polarize(30)
-			else:
+			handler = self._POSTPROCESS_STEPS.get(postproc_step)
+			if handler is None:
 				raise NotImplementedError(postproc_step)
+			handler(cctx)
 		return cctx
 
-	def _render_generic_file(self, step, interpreter_class, infile):
-		src_color = self._parse_color(self._replace_definitions(step.get("color", "#000000")))
+	def _read_source(self, archive, infile):
+		if archive is None:
+			with open(infile, "rb") as f:
+				return f.read()
+		else:
+			# Decompress directly from the archive member
+			with self._open_archive(archive).open(infile) as f:
+				return f.read()
+
+	def _parse_source(self, interpreter_class, archive, infile):
+		# Parse the bytes read to derive the source digest, if any
+		data = self._source_data.pop((archive, infile), None)
+		if data is None:
+			data = self._read_source(archive, infile)
+		return interpreter_class.parse(data, spatial_index = self._spatial_index)
+
+	def _get_display_list(self, interpreter_class, archive, infile):
+		"""Every source file is only parsed once per session, all render steps
+		referencing the same file replay the cached display list."""
+		key = (interpreter_class.__name__, archive, infile)
+		if key not in self._display_lists:
+			display_list = None
+			if self._display_list_cache is not None:
+				# Shared between boards, keyed by file contents
+				shared_key = (interpreter_class.__name__, self._source_digest(archive, infile), self._spatial_index)
+				display_list = self._display_list_cache.get(shared_key)
+				if display_list is not None:
+					self._source_data.pop((archive, infile), None)
+			if display_list is None:
+				if self._args.verbose >= 2:
+					print("Parsing %s [archive %s] using %s" % (infile, archive, interpreter_class.__name__), file = sys.stderr)
+				with self._profiler.section("parse"):
+					display_list = self._parse_source(interpreter_class, archive, infile)
+				if self._display_list_cache is not None:
+					self._display_list_cache.put(shared_key, display_list)
+			self._display_lists[key] = display_list
+		return self._display_lists[key]
+
+	def _rasterize_display_list(self, step, display_list, cctx, area = None, color = None):
+		if "background" in step:
+			bg_color = self._parse_color(self._replace_definitions(step["background"]))
+			cctx.fill(bg_color, area = area)
+
+		if color is None:
+			src_color = self._parse_color(self._replace_definitions(step.get("color", "#000000")))
+		else:
+			src_color = color
+		callback = CairoCallback(cctx, src_color = src_color, render_mode = self._args.render_mode, aperture_cache = self._aperture_cache, profiler = self._profiler)
+		with self._profiler.section("rasterize"):
+			if self._profiler.enabled:
+				aperture_misses = self._aperture_cache.misses
+				for (operation, count) in display_list.statistics.items():
+					if operation in self._PRIMITIVE_COUNTERS:
+						self._profiler.count(self._PRIMITIVE_COUNTERS[operation], count)
+			# Only an area of the canvas is rendered, skip everything outside
+			cull_window = None if (area is None) else (area * (1 / cctx.dpi))
+			display_list.replay(callback, window = cull_window)
+			if self._profiler.enabled:
+				self._profiler.count("aperture_constructions", self._aperture_cache.misses - aperture_misses)
+
+		if "postprocess" in step:
+			with self._profiler.section("postprocess"):
+				cctx = self._apply_postprocess_steps(cctx, step["postprocess"])
+		return cctx
 
+	def _render_display_list(self, step, display_list, infile):
 		# Determine dimensions first
-		size_cb = SizeDeterminationCallback()
-		interpreter_class(infile, size_cb).run()
-		if (size_cb.max_pt is None) or (size_cb.min_pt is None):
+		extents = display_list.extents
+		if extents is None:
 			# No content here.
 			return None
 
-		dimensions = size_cb.max_pt - size_cb.min_pt
 		if self._args.verbose >= 2:
-			print("%s: dimensions %s to %s size %s" % (infile, size_cb.min_pt, size_cb.max_pt, dimensions), file = sys.stderr)
+			print("%s: dimensions %s to %s size %s" % (infile, extents.min_pt, extents.max_pt, extents.dimensions), file = sys.stderr)
 
-		cctx = CairoContext.create_inches(dimensions, offset_inches = size_cb.min_pt, dpi = self._args.resolution)
-		if "background" in step:
-			bg_color = self._parse_color(self._replace_definitions(step["background"]))
-			cctx.fill(bg_color)
-
-		callback = CairoCallback(cctx, src_color = src_color)
-		interpreter_class(infile, callback).run()
+		cctx = CairoContext.create_inches(extents.dimensions, offset_inches = extents.min_pt, dpi = self._args.resolution, mask = step.get("mask", False))
+		return self._rasterize_display_list(step, display_list, cctx)
 
-		if "postprocess" in step:
-			cctx = self._apply_postprocess_steps(cctx, step["postprocess"])
-		return cctx
-
-	def _render_generic(self, step, interpreter_class):
-		(archive, infile) = self._find_file(step["file_regex"], step.get("file_regex_opts"))
+	def _render_generic(self, name):
+		step = self._script["steps"][name]
+		interpreter_class = self._INTERPRETERS[step["action"]]
+		(archive, infile) = self._leaf_source(name)
 		if infile is None:
 			return None
 		if self._args.verbose >= 2:
 			print("Rendering %s [archive %s] using %s" % (infile, archive, interpreter_class.__name__), file = sys.stderr)
 
-		if archive is None:
-			return self._render_generic_file(step, interpreter_class, infile)
-		else:
-			# Extract to tempfile, then render
-			with tempfile.NamedTemporaryFile(prefix = "gerberpeek_", suffix = ".infile") as f, zipfile.ZipFile(archive) as zfile:
-				f.write(zfile.open(infile).read())
-				f.flush()
-				return self._render_generic_file(step, interpreter_class, f.name)
-
-	def _render_gerber(self, step):
-		return self._render_generic(step, Interpreter)
+		display_list = self._get_display_list(interpreter_class, archive, infile)
+		return self._render_display_list(step, display_list, infile)
 
-	def _render_drill(self, step):
-		return self._render_generic(step, DrillInterpreter)
+	def _source_color(self, source):
+		"""Returns the color a composition source is tinted in. Without an
+		explicit color, masks are tinted in the color of their render step."""
+		if "color" in source:
+			return self._parse_color(self._replace_definitions(source["color"]))
+		source_step = self._script["steps"][source["name"]]
+		if source_step.get("mask", False) and ("color" in source_step):
+			return self._parse_color(self._replace_definitions(source_step["color"]))
+		return None
 
 	def _render_compose(self, step):
 		layers = [ ]
@@ -202,29 +386,330 @@ class Renderscript():
 
 		if len(layers) == 0:
 			return None
-		cctx = CairoContext.create_composition_canvas([ layer["ctx"] for layer in layers ], invert_y_axis = step.get("invert_y_axis", True))
-		if "background" in step:
-			bg_color = self._parse_color(self._replace_definitions(step["background"]))
-			cctx.fill(bg_color)
-		for layer in layers:
-			layer["ctx"].compose_onto(cctx, operator = layer["source"].get("operator", "over"))
+		with self._profiler.section("compose"):
+			cctx = CairoContext.create_composition_canvas([ layer["ctx"] for layer in layers ], invert_y_axis = step.get("invert_y_axis", True))
+			if "background" in step:
+				bg_color = self._parse_color(self._replace_definitions(step["background"]))
+				cctx.fill(bg_color)
+			for layer in layers:
+				layer["ctx"].compose_onto(cctx, operator = layer["source"].get("operator", "over"), color = self._source_color(layer["source"]))
 		return cctx
 
 	def _do_render(self, name):
 		step = self._script["steps"][name]
-		if step["action"] == "render-gerber":
-			return self._render_gerber(step)
-		elif step["action"] == "render-drill":
-			return self._render_drill(step)
+		if step["action"] in self._INTERPRETERS:
+			return self._render_generic(name)
 		elif step["action"] == "compose":
 			return self._render_compose(step)
 		else:
 			raise NotImplementedError(step["action"])
 
+	def _leaf_source(self, name):
+		"""Returns the (archive, filename) tuple a render step reads from."""
+		if name not in self._leaf_sources:
+			step = self._script["steps"][name]
+			self._leaf_sources[name] = self._find_file(step["file_regex"], step.get("file_regex_opts"))
+		return self._leaf_sources[name]
+
+	def _leaf_display_list(self, name):
+		if name not in self._leaf_display_lists:
+			step = self._script["steps"][name]
+			interpreter_class = self._INTERPRETERS[step["action"]]
+			(archive, infile) = self._leaf_source(name)
+			if infile is None:
+				self._leaf_display_lists[name] = None
+			else:
+				self._leaf_display_lists[name] = self._get_display_list(interpreter_class, archive, infile)
+		return self._leaf_display_lists[name]
+
+	def extents(self, name):
+		"""Returns the bounding box of a render step in inches, without
+		rasterizing anything, or None if the step has no content."""
+		if name not in self._extents:
+			step = self._script["steps"][name]
+			if step["action"] == "compose":
+				extents = None
+				for source in step["sources"]:
+					source_extents = self.extents(source["name"])
+					if source_extents is not None:
+						extents = source_extents.union(extents)
+			else:
+				display_list = self._leaf_display_list(name)
+				extents = None if (display_list is None) else display_list.extents
+			self._extents[name] = extents
+		return self._extents[name]
+
+	def render_window(self, name, window):
+		"""Renders a step onto a canvas that covers exactly the given window,
+		a pixel aligned BoundingBox in pixels at the render resolution, instead
+		of the step's own extents. Returns None if nothing of the step lies
+		inside the window. Compositions are never mirrored here, flipping the
+		final image is up to the caller."""
+		extents = self.extents(name)
+		if extents is None:
+			return None
+		area = (extents * self._args.resolution).intersection(window)
+		if area is None:
+			return None
+
+		step = self._script["steps"][name]
+		if step["action"] == "compose":
+			layers = [ ]
+			for source in step["sources"]:
+				sub_ctx = self.render_window(source["name"], window)
+				if sub_ctx is not None:
+					layers.append((source, sub_ctx))
+			if (len(layers) == 0) and ("background" not in step):
+				return None
+
+			cctx = CairoContext(dimensions = window.dimensions, offset = window.min_pt, dpi = self._args.resolution)
+			if "background" in step:
+				bg_color = self._parse_color(self._replace_definitions(step["background"]))
+				cctx.fill(bg_color, area = area)
+			for (source, sub_ctx) in layers:
+				sub_ctx.compose_onto(cctx, operator = source.get("operator", "over"), color = self._source_color(source))
+			return cctx
+		else:
+			cctx = CairoContext(dimensions = window.dimensions, offset = window.min_pt, dpi = self._args.resolution, mask = step.get("mask", False))
+			return self._rasterize_display_list(step, self._leaf_display_list(name), cctx, area = area)
+
+	def board_window(self, name):
+		"""Returns the window that covers the whole board as a pixel aligned
+		BoundingBox in pixels at the render resolution. This is the extent of
+		the step the render script names as "board_outline" or, if there is
+		none or it has no content, the extent of the step itself. Returns None
+		if there is nothing to render."""
+		extents = None
+		outline = self._script.get("board_outline")
+		if (outline is not None) and self.has_step(outline):
+			extents = self.extents(outline)
+		if extents is None:
+			extents = self.extents(name)
+		if extents is None:
+			return None
+		return (extents * self._args.resolution).pixel_aligned()
+
+	def _draws_directly(self, source):
+		"""Tells if a composition source can be drawn straight onto the
+		canvas of the composition. This holds for leaf steps that are composed
+		using the "over" operator and use neither clear polarity nor
+		postprocessing, all of which need a surface of their own."""
+		step = self._script["steps"][source["name"]]
+		if (step["action"] == "compose") or ("postprocess" in step) or (source.get("operator", "over") != "over"):
+			return False
+		display_list = self._leaf_display_list(source["name"])
+		return (display_list is None) or (not display_list.uses_clear)
+
+	def _render_canvas(self, name, window):
+		"""Renders a step onto one canvas that covers exactly the window, a
+		pixel aligned BoundingBox in pixels. Layers of a composition are drawn
+		directly onto that canvas where possible; the others are rendered onto
+		a canvas of identical size and offset and then composed. Unlike
+		render_window(), compositions are mirrored."""
+		step = self._script["steps"][name]
+		if step["action"] != "compose":
+			cctx = self.render_window(name, window)
+			if cctx is None:
+				cctx = CairoContext(dimensions = window.dimensions, offset = window.min_pt, dpi = self._args.resolution)
+			return cctx
+
+		cctx = CairoContext(dimensions = window.dimensions, offset = window.min_pt, dpi = self._args.resolution)
+		if step.get("invert_y_axis", True):
+			cctx.invert_y_axis()
+		if "background" in step:
+			bg_color = self._parse_color(self._replace_definitions(step["background"]))
+			cctx.fill(bg_color)
+		for source in step["sources"]:
+			self._check_deadline()
+			with self._profiler.section(source["name"]):
+				if self._draws_directly(source):
+					display_list = self._leaf_display_list(source["name"])
+					extents = None if (display_list is None) else display_list.extents
+					area = None if (extents is None) else (extents * self._args.resolution).intersection(window)
+					if area is not None:
+						# A previous source may have left another operator set
+						cctx.set_mode_draw()
+						self._rasterize_display_list(self._script["steps"][source["name"]], display_list, cctx, area = area, color = self._source_color(source))
+				else:
+					sub_ctx = self.render_window(source["name"], window)
+					if sub_ctx is not None:
+						sub_ctx.compose_onto(cctx, operator = source.get("operator", "over"), color = self._source_color(source))
+		return cctx
+
+	def render_common_canvas(self, name):
+		"""Renders a step onto one canvas that has the dimensions of the whole
+		board, see board_window(). Returns None if there is nothing to
+		render."""
+		with self._profiler.section(name):
+			window = self.board_window(name)
+			if window is None:
+				return None
+			return self._render_canvas(name, window)
+
+	@staticmethod
+	def parse_viewport(text):
+		"""Parses a viewport given as "x1,y1,x2,y2" in inches, optionally
+		followed by the unit "in" or "mm", into a BoundingBox in inches."""
+		text = text.strip()
+		scale = 1
+		if text.endswith("mm"):
+			(text, scale) = (text[:-2], 1 / 25.4)
+		elif text.endswith("in"):
+			text = text[:-2]
+		values = [ float(value) * scale for value in text.split(",") ]
+		if len(values) != 4:
+			raise ValueError("Viewport needs to consist of four coordinates, x1,y1,x2,y2.")
+		(x1, y1, x2, y2) = values
+		if (x1 == x2) or (y1 == y2):
+			raise ValueError("Viewport must not be empty.")
+		return BoundingBox(Vector2d(min(x1, x2), min(y1, y2)), Vector2d(max(x1, x2), max(y1, y2)))
+
+	def viewport_window(self, viewport):
+		"""Returns the pixel aligned window covering a viewport, a BoundingBox
+		in inches, at the render resolution."""
+		return (viewport * self._args.resolution).pixel_aligned()
+
+	def _use_spatial_index(self):
+		"""Partial renders replay only a small window of every display list,
+		so sources parsed from now on are indexed to find the primitives in
+		it without visiting all others."""
+		self._spatial_index = True
+
+	def render_viewport(self, name, viewport):
+		"""Renders only the part of a step inside the viewport, a BoundingBox
+		in inches. All canvases are only as large as the viewport and
+		primitives outside of it are skipped, so rendering costs in proportion
+		to the area shown. Returns None if the step has no content at all."""
+		self._use_spatial_index()
+		with self._profiler.section(name):
+			if self.extents(name) is None:
+				return None
+			return self._render_canvas(name, self.viewport_window(viewport))
+
+	def _render_strips(self, name, window, tile_size, invert_y_axis):
+		(x0, y0, x1, y1) = (int(window.min_pt.x), int(window.min_pt.y), int(window.max_pt.x), int(window.max_pt.y))
+		if invert_y_axis:
+			strip_bounds = [ (max(y0, top - tile_size), top) for top in range(y1, y0, -tile_size) ]
+		else:
+			strip_bounds = [ (bottom, min(y1, bottom + tile_size)) for bottom in range(y0, y1, tile_size) ]
+
+		for (strip_y0, strip_y1) in strip_bounds:
+			strip = CairoContext(dimensions = Vector2d(x1 - x0, strip_y1 - strip_y0), dpi = self._args.resolution)
+			for tile_x0 in range(x0, x1, tile_size):
+				self._check_deadline()
+				tile_window = BoundingBox(Vector2d(tile_x0, strip_y0), Vector2d(min(x1, tile_x0 + tile_size), strip_y1))
+				tile = self.render_window(name, tile_window)
+				if tile is not None:
+					strip.paint_at(tile, Vector2d(tile_x0 - x0, 0), invert_y_axis = invert_y_axis)
+			yield strip
+
+	def render_tiled(self, name, tile_size, common_canvas = False, viewport = None):
+		"""Renders a step tile by tile so that no surface larger than a tile
+		(per layer) or a strip of the output needs to be allocated. Returns
+		None if there is no content, otherwise a tuple of the output
+		dimensions in pixels and an iterator over horizontal strips of the
+		final image, top to bottom, each at most tile_size pixels high. With
+		common_canvas set, the image covers board_window() instead of the
+		step's own extents, with a viewport given only the viewport."""
+		self._use_spatial_index()
+		if viewport is not None:
+			if self.extents(name) is None:
+				return None
+			window = self.viewport_window(viewport)
+		elif common_canvas:
+			window = self.board_window(name)
+			if window is None:
+				return None
+		else:
+			extents = self.extents(name)
+			if extents is None:
+				return None
+			window = (extents * self._args.resolution).pixel_aligned()
+		step = self._script["steps"][name]
+		invert_y_axis = (step["action"] == "compose") and step.get("invert_y_axis", True)
+		return (window.dimensions, self._render_strips(name, window, tile_size, invert_y_axis))
+
+	def is_rendered(self, name):
+		return name in self._deliverables
+
+	def set_rendering(self, name, rendering):
+		"""Stores a rendering that was produced elsewhere, e.g., by a render
+		worker process."""
+		self._deliverables[name] = rendering
+
+	def _source_digest(self, archive, infile):
+		"""Identifies the contents of a source file, plain or archive member,
+		by the SHA-256 of its bytes. The bytes read are kept until the file is
+		parsed, so archive members are only decompressed once, or until it
+		turns out that the file is not parsed, see release_source_data()."""
+		key = (archive, infile)
+		if key not in self._source_digests:
+			data = self._read_source(archive, infile)
+			self._source_data[key] = data
+			self._source_digests[key] = hashlib.sha256(data).hexdigest()
+		return self._source_digests[key]
+
+	def release_source_data(self, name):
+		"""Drops the bytes kept for the source files of a step and all steps
+		it composes, once they are not going to be parsed in this process,
+		e.g., because the rendering came from the render cache."""
+		step = self._script["steps"][name]
+		if step["action"] == "compose":
+			for source in step["sources"]:
+				self.release_source_data(source["name"])
+		else:
+			self._source_data.pop(self._leaf_source(name), None)
+
+	def cache_key(self, name):
+		"""Returns the render cache key of a step. It covers the step
+		definition with all definitions substituted, the contents of the source
+		file or the keys of all composed steps, the resolution, render mode and
+		the gerberpeek version."""
+		if name not in self._cache_keys:
+			if not self.has_step(name):
+				raise RenderscriptSyntaxError("Unknown render step '%s'." % (name))
+			step = self._script["steps"][name]
+			resolved_step = self._replace_definitions(json.dumps(step, sort_keys = True))
+			if step["action"] == "compose":
+				self._cache_keys[name] = None
+				dependencies = [ self.cache_key(source["name"]) for source in step["sources"] ]
+			else:
+				(archive, infile) = self._leaf_source(name)
+				dependencies = None if (infile is None) else self._source_digest(archive, infile)
+			self._cache_keys[name] = RenderCache.key(VERSION, resolved_step, dependencies, self._args.resolution, self._args.render_mode)
+		elif self._cache_keys[name] is None:
+			raise RenderscriptSyntaxError("Render step '%s' depends on itself." % (name))
+		return self._cache_keys[name]
+
+	def is_cached(self, name):
+		if (self._render_cache is None) or (self.cache_key(name) not in self._render_cache):
+			return False
+		self.release_source_data(name)
+		return True
+
+	def _cached_render(self, name):
+		if self._render_cache is None:
+			return self._do_render(name)
+
+		key = self.cache_key(name)
+		with self._profiler.section("cache"):
+			(hit, rendering) = self._render_cache.get(key)
+		if hit:
+			self.release_source_data(name)
+			if self._args.verbose >= 2:
+				print("Using cached rendering of %s [%s]" % (name, key), file = sys.stderr)
+			return rendering
+
+		rendering = self._do_render(name)
+		self._render_cache.put(key, rendering)
+		return rendering
+
 	def render(self, name):
 		needs_render = name not in self._deliverables
 		if needs_render:
-			self._deliverables[name] = self._do_render(name)
+			self._check_deadline()
+			with self._profiler.section(name):
+				self._deliverables[name] = self._cached_render(name)
 
 		rendering = self._deliverables[name]
 		if self._args.debug_intermediate and needs_render and (rendering is not None):
@@ -234,3 +719,30 @@ class Renderscript():
 			rendering.dump(name)
 
 		return rendering
+
+	def write_deliverable(self, name, outfile, png_format = "rgba8", compression = 6, tile_size = None, common_canvas = False, viewport = None):
+		"""Renders a step and writes it as PNG to outfile, a filename or a
+		binary stream. With a tile size given, it is rendered and written tile
+		by tile. With common_canvas set, it is rendered using
+		render_common_canvas(), with a viewport using render_viewport().
+		Returns False if there was nothing to render."""
+		if tile_size is None:
+			if viewport is not None:
+				result = self.render_viewport(name, viewport)
+			elif common_canvas:
+				result = self.render_common_canvas(name)
+			else:
+				result = self.render(name)
+			if result is None:
+				return False
+			with self._profiler.section("write:" + name), PNGWriter.open(outfile, result.width, result.height, png_format = png_format, compression = compression) as png:
+				png.write_strip(result)
+		else:
+			tiled = self.render_tiled(name, tile_size = tile_size, common_canvas = common_canvas, viewport = viewport)
+			if tiled is None:
+				return False
+			(dimensions, strips) = tiled
+			with PNGWriter.open(outfile, int(dimensions.x), int(dimensions.y), png_format = png_format, compression = compression) as png:
+				for strip in strips:
+					png.write_strip(strip)
+		return True
@@ -0,0 +1,40 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+class SourceReader():
+	@staticmethod
+	def _decode(data):
+		return data.decode("utf-8", errors = "replace")
+
+	@classmethod
+	def read_text(cls, source):
+		"""Returns the whole text of a source file. The source may be given as
+		a filename, as a bytes-like buffer or as text or binary stream (e.g., a
+		member opened from a ZIP archive)."""
+		if isinstance(source, str):
+			with open(source, "rb") as f:
+				return cls._decode(f.read())
+		elif isinstance(source, (bytes, bytearray, memoryview)):
+			return cls._decode(bytes(source))
+		else:
+			data = source.read()
+			if isinstance(data, str):
+				return data
+			return cls._decode(data)
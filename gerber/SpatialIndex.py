@@ -0,0 +1,143 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import math
+import collections
+
+class SpatialIndex():
+	"""Hierarchical grid over the bounding boxes of primitives, answering
+	which primitives lie at a point or within a rectangle by only looking at
+	the grid cells involved. Every level doubles the cell size of the one
+	below and every entry is stored exactly once, in the cell holding its
+	minimum corner on the lowest level whose cells are at least as large as
+	the entry. It therefore extends into the neighboring cells at most, no
+	matter if it is a tiny pad or a board-sized ground plane.
+
+	Entries are added in drawing order while parsing and the grid is built
+	once on the first query (or explicitly by build()). Every entry stores
+	the position of its operation within the display list, the operation
+	name, its bounds as a tuple of (minx, miny, maxx, maxy) in inches, the
+	selected aperture and the source line it was parsed from."""
+	Entry = collections.namedtuple("SpatialIndexEntry", [ "index", "operation", "box", "aperture", "line" ])
+
+	def __init__(self):
+		self._entries = [ ]
+		self._levels = None
+		self._origin = None
+		self._cell_size = None
+
+	def add(self, index, operation, box, aperture, line):
+		self._entries.append(self.Entry(index, operation, box, aperture, line))
+		self._levels = None
+
+	def build(self):
+		"""Sorts all entries into the grid."""
+		levels = [ ]
+		if len(self._entries) > 0:
+			minx = min(entry.box[0] for entry in self._entries)
+			miny = min(entry.box[1] for entry in self._entries)
+			maxx = max(entry.box[2] for entry in self._entries)
+			maxy = max(entry.box[3] for entry in self._entries)
+			# Cells of the lowest level would hold about one entry each if
+			# they were spread evenly
+			size = max(maxx - minx, maxy - miny, 1e-6)
+			cell_size = max(math.sqrt((maxx - minx) * (maxy - miny) / len(self._entries)), size / 4096)
+			levels = [ { } for level in range(max(math.ceil(math.log2(size / cell_size)), 0) + 1) ]
+			(self._origin, self._cell_size) = ((minx, miny), cell_size)
+
+			for (entry_id, entry) in enumerate(self._entries):
+				(x0, y0, x1, y1) = entry.box
+				extent = max(x1 - x0, y1 - y0)
+				level = 0 if (extent <= cell_size) else min(math.ceil(math.log2(extent / cell_size)), len(levels) - 1)
+				level_cell_size = cell_size * (1 << level)
+				key = (int((x0 - minx) / level_cell_size), int((y0 - miny) / level_cell_size))
+				cell = levels[level].get(key)
+				if cell is None:
+					levels[level][key] = [ entry_id ]
+				else:
+					cell.append(entry_id)
+
+		# Only published when complete, display lists are shared between
+		# render threads
+		self._levels = levels
+
+	def intersecting(self, minx, miny, maxx, maxy):
+		"""Returns the ascending ids of all entries whose bounds intersect the
+		rectangle."""
+		if self._levels is None:
+			self.build()
+		entries = self._entries
+		if len(entries) == 0:
+			return [ ]
+		(origin_x, origin_y) = self._origin
+		candidates = [ ]
+		for (level, grid) in enumerate(self._levels):
+			level_cell_size = self._cell_size * (1 << level)
+			# Entries reach at most one cell beyond their minimum corner
+			x0 = max(int((minx - origin_x) / level_cell_size) - 1, 0)
+			y0 = max(int((miny - origin_y) / level_cell_size) - 1, 0)
+			x1 = int((maxx - origin_x) / level_cell_size)
+			y1 = int((maxy - origin_y) / level_cell_size)
+			if (x1 < x0) or (y1 < y0):
+				continue
+			if (x1 - x0 + 1) * (y1 - y0 + 1) > len(grid):
+				# Visiting the cells is more expensive than visiting the
+				# occupied ones
+				for ((x, y), cell) in grid.items():
+					if (x0 <= x <= x1) and (y0 <= y <= y1):
+						candidates += cell
+			else:
+				for y in range(y0, y1 + 1):
+					for x in range(x0, x1 + 1):
+						cell = grid.get((x, y))
+						if cell is not None:
+							candidates += cell
+		candidates.sort()
+
+		result = [ ]
+		for entry_id in candidates:
+			box = entries[entry_id].box
+			if (box[0] <= maxx) and (box[2] >= minx) and (box[1] <= maxy) and (box[3] >= miny):
+				result.append(entry_id)
+		return result
+
+	def at(self, point, tolerance = 0):
+		"""All entries whose bounds contain the point in inches or come closer
+		to it than the tolerance, in drawing order."""
+		return [ self._entries[entry_id] for entry_id in self.intersecting(point.x - tolerance, point.y - tolerance, point.x + tolerance, point.y + tolerance) ]
+
+	def within(self, bounding_box):
+		"""All entries whose bounds intersect the BoundingBox in inches, in
+		drawing order."""
+		return [ self._entries[entry_id] for entry_id in self.intersecting(bounding_box.min_pt.x, bounding_box.min_pt.y, bounding_box.max_pt.x, bounding_box.max_pt.y) ]
+
+	def __getitem__(self, entry_id):
+		return self._entries[entry_id]
+
+	def __iter__(self):
+		return iter(self._entries)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __repr__(self):
+		if self._levels is None:
+			return "SpatialIndex<%d entries>" % (len(self))
+		return "SpatialIndex<%d entries, %d levels, %d cells>" % (len(self), len(self._levels), sum(len(grid) for grid in self._levels))
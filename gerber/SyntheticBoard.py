@@ -0,0 +1,219 @@
+#	gerberpeek - Render RS-274X Gerber files to image
+#	Copyright (C) 2019-2021 Johannes Bauer
+#
+#	This file is part of gerberpeek.
+#
+#	gerberpeek is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gerberpeek is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import io
+import math
+import random
+import zipfile
+
+class SyntheticBoard():
+	"""Generates reproducible, random boards for benchmarking: a top copper
+	layer with traces, flashes, arcs and regions, a soldermask layer with the
+	pads, a board outline and an Excellon drill file. Everything is placed on
+	a board of the given size in mm, files are written in the given unit,
+	"mm" or "inch"."""
+
+	def __init__(self, traces = 1000, flashes = 500, regions = 20, arcs = 100, drills = 300, unit = "mm", size = (100, 80), seed = 0):
+		assert(unit in [ "mm", "inch" ])
+		self._traces = traces
+		self._flashes = flashes
+		self._regions = regions
+		self._arcs = arcs
+		self._drills = drills
+		self._unit = unit
+		self._seed = seed
+		self._scale = 1 if (unit == "mm") else (1 / 25.4)
+		self._size = (self._mm(size[0]), self._mm(size[1]))
+		self._pads = None
+
+	@property
+	def primitive_count(self):
+		return self._traces + self._flashes + self._regions + self._arcs
+
+	@property
+	def drill_count(self):
+		return self._drills
+
+	def _mm(self, value):
+		"""Converts a length given in mm to the board unit."""
+		return value * self._scale
+
+	def _coord(self, value):
+		# Format 2.6 (inch) or 4.6 (mm), leading zeros omitted
+		return "%d" % (round(value * 1e6))
+
+	def _xy(self, x, y):
+		return "X%sY%s" % (self._coord(x), self._coord(y))
+
+	def _random_point(self, rnd, margin):
+		(width, height) = self._size
+		return (rnd.uniform(margin, width - margin), rnd.uniform(margin, height - margin))
+
+	def _gerber_header(self, f, name):
+		print("G04 gerberpeek synthetic board, %s*" % (name), file = f)
+		if self._unit == "mm":
+			print("%FSLAX46Y46*%", file = f)
+			print("%MOMM*%", file = f)
+		else:
+			print("%FSLAX26Y26*%", file = f)
+			print("%MOIN*%", file = f)
+		print("%LPD*%", file = f)
+
+	def _pad_list(self):
+		if self._pads is None:
+			rnd = random.Random(self._seed + 1)
+			self._pads = [ (rnd.randrange(3), self._random_point(rnd, self._mm(3))) for i in range(self._flashes) ]
+		return self._pads
+
+	def _write_copper(self, f):
+		rnd = random.Random(self._seed)
+		self._gerber_header(f, "top copper")
+		print("%%ADD10C,%f*%%" % (self._mm(0.25)), file = f)
+		print("%%ADD11C,%f*%%" % (self._mm(0.5)), file = f)
+		print("%%ADD12R,%fX%f*%%" % (self._mm(1.5), self._mm(1.0)), file = f)
+		print("%%ADD13O,%fX%f*%%" % (self._mm(1.2), self._mm(2.0)), file = f)
+		print("%%ADD14C,%f*%%" % (self._mm(1.6)), file = f)
+
+		# Traces as polylines of a few segments each
+		trace = 0
+		while trace < self._traces:
+			print("D%d*" % (rnd.choice([ 10, 11 ])), file = f)
+			(x, y) = self._random_point(rnd, self._mm(2))
+			print("%sD02*" % (self._xy(x, y)), file = f)
+			for segment in range(min(rnd.randrange(1, 8), self._traces - trace)):
+				(x, y) = self._random_point(rnd, self._mm(2))
+				print("%sD01*" % (self._xy(x, y)), file = f)
+				trace += 1
+
+		# Multi-quadrant arcs, some of them full circles
+		if self._arcs > 0:
+			print("D10*", file = f)
+			print("G75*", file = f)
+			for arc in range(self._arcs):
+				radius = self._mm(rnd.uniform(0.5, 5))
+				(cx, cy) = self._random_point(rnd, radius + self._mm(1))
+				start_angle = rnd.uniform(0, 2 * math.pi)
+				end_angle = start_angle if ((arc % 10) == 0) else rnd.uniform(0, 2 * math.pi)
+				(sx, sy) = (cx + radius * math.cos(start_angle), cy + radius * math.sin(start_angle))
+				(ex, ey) = (cx + radius * math.cos(end_angle), cy + radius * math.sin(end_angle))
+				print("%sD02*" % (self._xy(sx, sy)), file = f)
+				print("G0%d%sI%sJ%sD01*" % (rnd.choice([ 2, 3 ]), self._xy(ex, ey), self._coord(cx - sx), self._coord(cy - sy)), file = f)
+			print("G01*", file = f)
+
+		# Flashed pads
+		current_aperture = None
+		for (aperture, (x, y)) in self._pad_list():
+			if aperture != current_aperture:
+				print("D%d*" % (12 + aperture), file = f)
+				current_aperture = aperture
+			print("%sD03*" % (self._xy(x, y)), file = f)
+
+		# Convex polygon regions
+		for region in range(self._regions):
+			radius = self._mm(rnd.uniform(1, 8))
+			(cx, cy) = self._random_point(rnd, radius)
+			corners = [ (cx + radius * math.cos(2 * math.pi * i / 6), cy + radius * math.sin(2 * math.pi * i / 6)) for i in range(6) ]
+			print("G36*", file = f)
+			print("%sD02*" % (self._xy(*corners[0])), file = f)
+			for (x, y) in corners[1:] + corners[:1]:
+				print("%sD01*" % (self._xy(x, y)), file = f)
+			print("G37*", file = f)
+		print("M02*", file = f)
+
+	def _write_soldermask(self, f):
+		self._gerber_header(f, "top soldermask")
+		for (aperture, (width, height)) in enumerate([ (1.7, 1.2), (1.4, 2.2), (1.8, 1.8) ]):
+			template = "C,%f" % (self._mm(width)) if (aperture == 2) else "%s,%fX%f" % ("RO"[aperture], self._mm(width), self._mm(height))
+			print("%%ADD%d%s*%%" % (10 + aperture, template), file = f)
+		current_aperture = None
+		for (aperture, (x, y)) in self._pad_list():
+			if aperture != current_aperture:
+				print("D%d*" % (10 + aperture), file = f)
+				current_aperture = aperture
+			print("%sD03*" % (self._xy(x, y)), file = f)
+		print("M02*", file = f)
+
+	def _write_outline(self, f):
+		(width, height) = self._size
+		self._gerber_header(f, "outline")
+		print("%%ADD10C,%f*%%" % (self._mm(0.1)), file = f)
+		print("D10*", file = f)
+		print("%sD02*" % (self._xy(0, 0)), file = f)
+		for (x, y) in [ (width, 0), (width, height), (0, height), (0, 0) ]:
+			print("%sD01*" % (self._xy(x, y)), file = f)
+		print("M02*", file = f)
+
+	def _write_drill(self, f):
+		rnd = random.Random(self._seed + 2)
+		diameters = [ 0.3, 0.8, 1.0, 3.2 ]
+		print("M48", file = f)
+		print("METRIC" if (self._unit == "mm") else "INCH", file = f)
+		for (tool, diameter) in enumerate(diameters, 1):
+			print("T%dC%.4f" % (tool, self._mm(diameter)), file = f)
+		print("%", file = f)
+		print("G05", file = f)
+		holes = sorted((rnd.randrange(len(diameters)), self._random_point(rnd, self._mm(3))) for i in range(self._drills))
+		current_tool = None
+		for (tool, (x, y)) in holes:
+			if tool != current_tool:
+				print("T%d" % (tool + 1), file = f)
+				current_tool = tool
+			print("X%.4fY%.4f" % (x, y), file = f)
+		print("M30", file = f)
+
+	def _generate(self, writer):
+		f = io.StringIO()
+		writer(f)
+		return f.getvalue()
+
+	@property
+	def copper(self):
+		return self._generate(self._write_copper)
+
+	@property
+	def soldermask(self):
+		return self._generate(self._write_soldermask)
+
+	@property
+	def outline(self):
+		return self._generate(self._write_outline)
+
+	@property
+	def drill(self):
+		return self._generate(self._write_drill)
+
+	def files(self, basename = "synthetic"):
+		"""Returns a dictionary of filenames to contents, named so that the
+		default render script picks them up."""
+		return {
+			basename + ".gtl":		self.copper,
+			basename + ".gts":		self.soldermask,
+			basename + ".gko":		self.outline,
+			basename + ".drl":		self.drill,
+		}
+
+	def write_zip(self, f, basename = "synthetic"):
+		"""Writes all layers into a ZIP file, given as filename or stream."""
+		with zipfile.ZipFile(f, "w", compression = zipfile.ZIP_DEFLATED) as zfile:
+			for (filename, content) in self.files(basename).items():
+				zfile.writestr(filename, content)
+
+	def __repr__(self):
+		return "SyntheticBoard<%d traces, %d flashes, %d regions, %d arcs, %d drills, %s>" % (self._traces, self._flashes, self._regions, self._arcs, self._drills, self._unit)
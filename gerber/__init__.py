@@ -18,10 +18,25 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+VERSION = "0.1.0"
+
 from .Interpreter import Interpreter
 from .DrillInterpreter import DrillInterpreter
 from .InterpreterCallbacks import CairoCallback, SizeDeterminationCallback
 from .CairoContext import CairoContext
 from .Vector2d import Vector2d
-from .Renderscript import Renderscript
+from .BoundingBox import BoundingBox
+from .Extents import Extents
+from .PNGWriter import PNGWriter
+from .Profiler import Profiler
+from .DisplayList import DisplayList
+from .SpatialIndex import SpatialIndex
+from .SyntheticBoard import SyntheticBoard
 from .ApertureRenderer import ApertureRenderer
+from .ApertureCache import ApertureCache
+from .RenderCache import RenderCache
+from .DisplayListCache import DisplayListCache
+from .Renderscript import Renderscript
+from .RenderScheduler import RenderScheduler
+from .BatchRenderer import BatchRenderer, BatchJob
+from .RenderServer import RenderServer